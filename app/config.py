@@ -1,5 +1,6 @@
+from functools import cached_property, lru_cache
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import FrozenSet, List
 
 class Settings(BaseSettings):
     # API Settings
@@ -31,13 +32,28 @@ class Settings(BaseSettings):
     
     # File Upload
     MAX_FILE_SIZE: int = 10 * 1024 * 1024  # 10MB
+    MAX_BATCH_FILES: int = 10  # files per /upload/batch request
     ALLOWED_FILE_TYPES: List[str] = [".pdf", ".docx", ".doc", ".txt"]
-    UPLOAD_DIR: str = "uploads"
+    UPLOAD_DIR: str = "/dev/shm/docpilot"  # where large uploads spill while being converted
     
     # Document Conversion
     CONVERSION_CONFIG: dict = {}
+    CONVERSION_EXECUTOR: str = "process"  # "process" or "thread"
+    CONVERSION_WORKERS: int = 2  # concurrent conversions; each can hold a whole document in memory
+    MAX_CONCURRENT_CONVERSIONS: int = 4  # uploads being read and converted at once
+    MAX_CONCURRENT_DB_WRITES: int = 10  # concurrent Supabase inserts from uploads
     
     class Config:
         env_file = ".env"
+    
+    @cached_property
+    def ALLOWED_FILE_TYPES_SET(self) -> FrozenSet[str]:
+        """ALLOWED_FILE_TYPES as a frozenset for O(1) extension checks"""
+        return frozenset(ext.lower() for ext in self.ALLOWED_FILE_TYPES)
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Load settings once per process"""
+    return Settings()
 
-settings = Settings()
\ No newline at end of file
+settings = get_settings()
\ No newline at end of file
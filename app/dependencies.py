@@ -1,17 +1,49 @@
+from functools import lru_cache
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
 from app.config import settings
-from app.services.auth_service import AuthService
+from app.services.auth_service import AuthService, UserInfo
+from app.services.database_service import DatabaseService
+from app.services.document_converter import DocumentConverter
+from app.services.file_service import FileService
+from app.services.upload_session_service import UploadSessionService
 
 security = HTTPBearer()
+security_optional = HTTPBearer(auto_error=False)  # For endpoints where authentication is optional
+
+@lru_cache(maxsize=1)
+def get_auth_service() -> AuthService:
+    """Shared AuthService instance"""
+    return AuthService()
+
+@lru_cache(maxsize=1)
+def get_db_service() -> DatabaseService:
+    """Shared DatabaseService instance (one Supabase client per process)"""
+    return DatabaseService()
+
+@lru_cache(maxsize=1)
+def get_document_converter() -> DocumentConverter:
+    """Shared DocumentConverter instance (one conversion thread pool per process)"""
+    return DocumentConverter()
+
+@lru_cache(maxsize=1)
+def get_file_service() -> FileService:
+    """Shared FileService instance, built on the shared converter and database service"""
+    return FileService(get_document_converter(), get_db_service())
+
+@lru_cache(maxsize=1)
+def get_upload_session_service() -> UploadSessionService:
+    """Shared UploadSessionService instance for resumable uploads"""
+    return UploadSessionService(get_file_service())
 
 async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security)
-) -> dict:
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    auth_service: AuthService = Depends(get_auth_service)
+) -> UserInfo:
     """Validate JWT token and return user info"""
     try:
-        auth_service = AuthService()
         user = await auth_service.validate_token(credentials.credentials)
         return user
     except Exception as e:
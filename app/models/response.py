@@ -1,7 +1,21 @@
+from typing import List, Optional
+
 from pydantic import BaseModel
 
 class FileUploadResponse(BaseModel):
     success: bool
     file_id: str
     filename: str
-    message: str
\ No newline at end of file
+    message: str
+
+class BatchFileUploadResult(BaseModel):
+    success: bool
+    file_id: Optional[str] = None
+    filename: str
+    message: str
+
+class BatchFileUploadResponse(BaseModel):
+    success: bool
+    results: List[BatchFileUploadResult]
+    uploaded: int
+    failed: int
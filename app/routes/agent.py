@@ -3,24 +3,23 @@ API router for agent interactions - Graph-based smart agent.
 Updated to support both local files (legacy) and Supabase workspace integration.
 """
 
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from functools import lru_cache
 
 from app.services.graph_agent import SmartGraphAgent
 from app.services.supabase_graph_agent import create_supabase_agent
-from app.dependencies import get_current_user
+from app.dependencies import get_current_user, get_auth_service, get_db_service, security_optional
 from app.services.database_service import DatabaseService
-from app.services.auth_service import AuthService
+from app.services.auth_service import AuthService, UserInfo
 from app.utils.exceptions import AppException
 
-security = HTTPBearer(auto_error=False)
-
-router = APIRouter(prefix="/agent", tags=["agent"])
-
-# Legacy agent instance for backward compatibility
-legacy_agent_instance: Optional[SmartGraphAgent] = None
+# Every agent route reads or edits documents on this server, so all of them need a signed-in user
+router = APIRouter(prefix="/agent", tags=["agent"], dependencies=[Depends(get_current_user)])
 
 
 class ChatRequest(BaseModel):
@@ -35,25 +34,33 @@ class ChatResponse(BaseModel):
     mode: str = "legacy"  # "legacy" or "workspace"
 
 
+class AnalyzeRequest(BaseModel):
+    workspace_id: str
+    filename: str
+    questions: List[str] = Field(min_length=1, max_length=10)
+
+
+class AnalyzeResponse(BaseModel):
+    answers: List[str]
+
 
 
+
+@lru_cache(maxsize=1)
 def get_legacy_agent() -> SmartGraphAgent:
     """Get or create legacy agent instance for backward compatibility."""
-    global legacy_agent_instance
-    if legacy_agent_instance is None:
-        # Import here to avoid circular imports
-        from app.services.graph_agent import SmartGraphAgent
-        legacy_agent_instance = SmartGraphAgent()
-    return legacy_agent_instance
+    return SmartGraphAgent()
 
 
-async def get_optional_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Optional[dict]:
+async def get_optional_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security_optional),
+    auth_service: AuthService = Depends(get_auth_service)
+) -> Optional[UserInfo]:
     """Get current user if token is provided, otherwise return None."""
     if not credentials:
         return None
     
     try:
-        auth_service = AuthService()
         user = await auth_service.validate_token(credentials.credentials)
         return user
     except Exception:
@@ -61,7 +68,11 @@ async def get_optional_current_user(credentials: HTTPAuthorizationCredentials =
 
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat_with_agent(request: ChatRequest, current_user: Optional[dict] = Depends(get_optional_current_user)):
+async def chat_with_agent(
+    request: ChatRequest,
+    current_user: Optional[UserInfo] = Depends(get_optional_current_user),
+    db_service: DatabaseService = Depends(get_db_service)
+):
     """
     Chat with the smart assistant.
     Supports both legacy mode (local files) and workspace mode (Supabase).
@@ -73,10 +84,9 @@ async def chat_with_agent(request: ChatRequest, current_user: Optional[dict] = D
             if not current_user:
                 raise HTTPException(status_code=401, detail="Authentication required for workspace mode")
             
-            user_id = current_user["id"]
+            user_id = current_user.id
             
             # Verify workspace access
-            db_service = DatabaseService()
             await _verify_workspace_access(db_service, request.workspace_id, user_id)
             
             # Create workspace-scoped agent
@@ -86,8 +96,9 @@ async def chat_with_agent(request: ChatRequest, current_user: Optional[dict] = D
             return ChatResponse(response=response, mode="workspace")
         else:
             # Legacy mode - use local file agent (authentication optional)
+            # The graph agent reads files and calls the LLM synchronously, so keep it off the event loop
             agent = get_legacy_agent()
-            response = agent.chat(request.message, context_file=request.context_file)
+            response = await run_in_threadpool(agent.chat, request.message, context_file=request.context_file)
             
             return ChatResponse(response=response, mode="legacy")
     
@@ -97,8 +108,77 @@ async def chat_with_agent(request: ChatRequest, current_user: Optional[dict] = D
         raise HTTPException(status_code=500, detail=f"Agent error: {str(e)}")
 
 
+@router.post("/chat/stream")
+async def chat_with_agent_stream(
+    request: ChatRequest,
+    current_user: Optional[UserInfo] = Depends(get_optional_current_user),
+    db_service: DatabaseService = Depends(get_db_service)
+):
+    """
+    Chat with the smart assistant, streaming the reply as plain text.
+    Document analysis in legacy mode arrives as it is generated; other replies arrive in one piece.
+    """
+    try:
+        if request.workspace_id:
+            if not current_user:
+                raise HTTPException(status_code=401, detail="Authentication required for workspace mode")
+            
+            await _verify_workspace_access(db_service, request.workspace_id, current_user.id)
+            
+            agent = create_supabase_agent(request.workspace_id, current_user.id)
+            response = await agent.chat(request.message, request.context_file)
+            chunks = iter([response])
+        else:
+            # Starlette runs a sync iterator in its threadpool, so the graph stays off the event loop
+            agent = get_legacy_agent()
+            chunks = agent.chat_stream(request.message, context_file=request.context_file)
+        
+        return StreamingResponse(chunks, media_type="text/plain; charset=utf-8")
+    
+    except AppException as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Agent error: {str(e)}")
+
+
+@router.post("/analyze", response_model=AnalyzeResponse)
+async def analyze_document(
+    request: AnalyzeRequest,
+    current_user: UserInfo = Depends(get_current_user),
+    db_service: DatabaseService = Depends(get_db_service)
+):
+    """
+    Ask several questions about one workspace document at once.
+    Answers come back in question order; the document is sent to the LLM as a shared prompt prefix.
+    """
+    try:
+        # Checks the user's workspace role before looking the file up
+        file_data = await db_service.find_workspace_file(request.workspace_id, current_user.id, request.filename)
+        if not file_data:
+            raise AppException(f"Document not found: {request.filename}", 404)
+        
+        agent = get_legacy_agent()
+        answers = await run_in_threadpool(
+            agent.analyze_batch, file_data["content"], file_data["filename"], request.questions
+        )
+        return AnalyzeResponse(answers=answers)
+    
+    except AppException as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analysis error: {str(e)}")
+
+
 @router.get("/status")
-async def get_agent_status(workspace_id: Optional[str] = None, current_user: Optional[dict] = Depends(get_optional_current_user)):
+async def get_agent_status(
+    request: Request,
+    response: Response,
+    workspace_id: Optional[str] = None,
+    current_user: Optional[UserInfo] = Depends(get_optional_current_user),
+    db_service: DatabaseService = Depends(get_db_service)
+):
     """Get agent status and conversation summary."""
     try:
         if workspace_id:
@@ -106,11 +186,15 @@ async def get_agent_status(workspace_id: Optional[str] = None, current_user: Opt
             if not current_user:
                 raise HTTPException(status_code=401, detail="Authentication required for workspace mode")
             
-            user_id = current_user["id"]
-            db_service = DatabaseService()
+            user_id = current_user.id
             await _verify_workspace_access(db_service, workspace_id, user_id)
             
-            files = await db_service.get_workspace_files(workspace_id, user_id)
+            # Skip the body if the client already has the current status
+            summary = await db_service.get_workspace_files_summary(workspace_id, user_id)
+            etag = f'W/"{workspace_id}-{summary["count"]}-{summary["last_updated_at"]}"'
+            if request.headers.get("if-none-match") == etag:
+                return Response(status_code=304, headers={"ETag": etag})
+            response.headers["ETag"] = etag
             
             return {
                 "status": "active",
@@ -118,7 +202,7 @@ async def get_agent_status(workspace_id: Optional[str] = None, current_user: Opt
                 "mode": "workspace",
                 "workspace_id": workspace_id,
                 "available_tools": ["search", "view", "edit"],
-                "available_files": len(files),
+                "available_files": summary["count"],
                 "user_id": user_id
             }
         else:
@@ -145,8 +229,7 @@ async def clear_conversation():
     """Clear the conversation history."""
     try:
         # Graph agent is stateless, so clearing means creating a new instance
-        global legacy_agent_instance
-        legacy_agent_instance = None
+        get_legacy_agent.cache_clear()
         
         return {"message": "Agent state cleared - new instance will be created on next request"}
     
@@ -174,16 +257,8 @@ async def get_conversation_summary():
 async def _verify_workspace_access(db_service: DatabaseService, workspace_id: str, user_id: str):
     """Verify that the user has access to the workspace."""
     try:
-        # Check if user is the owner
-        owner_result = db_service.supabase.table("workspaces").select("id").eq("id", workspace_id).eq("owner_id", user_id).execute()
-        
-        if owner_result.data:
-            return True
-        
-        # Check if user is a collaborator
-        collab_result = db_service.supabase.table("collaborators").select("id").eq("workspace_id", workspace_id).eq("user_id", user_id).execute()
-        
-        if collab_result.data:
+        # Owner or collaborator, resolved in a single query
+        if await db_service.get_workspace_role(workspace_id, user_id):
             return True
         
         # No access found
@@ -1,26 +1,29 @@
+import asyncio
 import logging
 from typing import Dict, List, Any, Optional
 from fastapi import APIRouter, HTTPException, status, Depends
 from pydantic import BaseModel
 
-from app.dependencies import get_current_user
+from app.dependencies import get_current_user, get_db_service
 from app.services.chunker import MarkdownChunkerStorage
 from app.services.database_service import DatabaseService
+from app.services.auth_service import UserInfo
 from app.utils.exceptions import AppException
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Maximum number of files chunked and upserted at the same time
+INDEX_CONCURRENCY = 8
+# Columns rendered by /index/status; file content is never fetched there
+INDEX_STATUS_COLUMNS = "id, filename, file_type, content_length, created_at"
+# Maximum number of failed files reported when per-file details are not requested
+MAX_REPORTED_ERRORS = 20
+
 class IndexRequest(BaseModel):
     workspace_id: Optional[str] = None
-
-class IndexResponse(BaseModel):
-    message: str
-    processed_files: List[Dict[str, Any]]
-    total_files: int
-    success_count: int
-    error_count: int
+    include_details: bool = False  # Return one result per file instead of just the summary
 
 class FileProcessingResult(BaseModel):
     file_id: str
@@ -31,6 +34,14 @@ class FileProcessingResult(BaseModel):
     chunk_types: Dict[str, int] = {}
     error_message: str = None
 
+class IndexResponse(BaseModel):
+    message: str
+    processed_files: List[FileProcessingResult] = []  # Only populated when include_details is set
+    errors: List[FileProcessingResult] = []  # First MAX_REPORTED_ERRORS failures
+    total_files: int
+    success_count: int
+    error_count: int
+
 class IndexingStatusResponse(BaseModel):
     workspace_files_count: int
     workspace_files: List[Dict[str, Any]]
@@ -40,32 +51,33 @@ class IndexingStatusResponse(BaseModel):
 @router.post("/index", response_model=IndexResponse)
 async def index_documents(
     request: IndexRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: UserInfo = Depends(get_current_user),
+    db_service: DatabaseService = Depends(get_db_service)
 ):
     """Process all files in the workspace and store them in vector database.
     Each file gets its own namespace based on the file ID."""
     
-    logger.info(f"Starting document indexing process for user {current_user['id']}")
+    logger.info(f"Starting document indexing process for user {current_user.id}")
     
     processed_files = []
+    errors = []
     success_count = 0
     error_count = 0
     
     try:
         # Initialize services
-        db_service = DatabaseService()
         chunker = MarkdownChunkerStorage()
         logger.info("Services initialized successfully")
         
         # Get files from database
         if request.workspace_id:
             # Get files from specific workspace
-            files = await db_service.get_workspace_files(request.workspace_id, current_user["id"])
+            files = await db_service.get_workspace_files(request.workspace_id, current_user.id)
             logger.info(f"Found {len(files)} files in workspace {request.workspace_id}")
         else:
             # Get all user files
-            files = await db_service.get_user_files(current_user["id"])
-            logger.info(f"Found {len(files)} files for user {current_user['id']}")
+            files = await db_service.get_user_files(current_user.id)
+            logger.info(f"Found {len(files)} files for user {current_user.id}")
         
         if not files:
             logger.warning("No files found to index")
@@ -77,28 +89,32 @@ async def index_documents(
                 error_count=0
             )
         
-        # Process each file
-        for file_record in files:
+        # Process files concurrently, bounded to avoid flooding Pinecone
+        semaphore = asyncio.Semaphore(INDEX_CONCURRENCY)
+        
+        async def process_file(file_record: Dict[str, Any]) -> FileProcessingResult:
             file_id = file_record["id"]
-            file_name = file_record["filename"]
             filename = file_record["filename"]
             content = file_record["content"]
             
             # Create namespace from file ID (ensures uniqueness)
-            namespace = f"{file_name}"
+            namespace = f"{filename}"
             
             logger.info(f"Processing file: {filename} (ID: {file_id}) -> namespace: {namespace}")
             
             try:
-                # Process and store the file content directly
-                result = chunker.process_and_store_content(
-                    content=content,
-                    namespace=namespace,
-                    filename=filename
-                )
+                async with semaphore:
+                    # Process and store the file content directly
+                    result = await chunker.process_and_store_content(
+                        content=content,
+                        namespace=namespace,
+                        filename=filename
+                    )
+                
+                logger.info(f"Successfully processed {filename}: {result['total_chunks']} chunks created")
                 
                 # Create successful result
-                file_result = FileProcessingResult(
+                return FileProcessingResult(
                     file_id=file_id,
                     filename=filename,
                     namespace=namespace,
@@ -106,24 +122,30 @@ async def index_documents(
                     total_chunks=result.get("total_chunks", 0),
                     chunk_types=result.get("chunk_types", {})
                 )
-                processed_files.append(file_result.dict())
-                success_count += 1
-                
-                logger.info(f"Successfully processed {filename}: {result['total_chunks']} chunks created")
                 
             except Exception as e:
                 error_message = f"Error processing {filename}: {str(e)}"
                 logger.error(error_message)
                 
                 # Create error result
-                file_result = FileProcessingResult(
+                return FileProcessingResult(
                     file_id=file_id,
                     filename=filename,
                     namespace=namespace,
                     status="error",
                     error_message=str(e)
                 )
-                processed_files.append(file_result.dict())
+        
+        file_results = await asyncio.gather(*(process_file(f) for f in files))
+        
+        for file_result in file_results:
+            if request.include_details:
+                processed_files.append(file_result)
+            if file_result.status == "success":
+                success_count += 1
+            else:
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append(file_result)
                 error_count += 1
         
         # Prepare response message
@@ -140,6 +162,7 @@ async def index_documents(
         return IndexResponse(
             message=message,
             processed_files=processed_files,
+            errors=errors,
             total_files=len(files),
             success_count=success_count,
             error_count=error_count
@@ -154,18 +177,17 @@ async def index_documents(
 @router.get("/index/status", response_model=IndexingStatusResponse)
 async def get_indexing_status(
     workspace_id: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    current_user: UserInfo = Depends(get_current_user),
+    db_service: DatabaseService = Depends(get_db_service)
 ):
     """Get the current status of files available for indexing"""
     
     try:
-        db_service = DatabaseService()
-        
         # Get files from database
         if workspace_id:
-            files = await db_service.get_workspace_files(workspace_id, current_user["id"])
+            files = await db_service.get_workspace_files(workspace_id, current_user.id, columns=INDEX_STATUS_COLUMNS)
         else:
-            files = await db_service.get_user_files(current_user["id"])
+            files = await db_service.get_user_files(current_user.id, columns=INDEX_STATUS_COLUMNS)
         
         # Format file information
         workspace_files = []
@@ -174,7 +196,7 @@ async def get_indexing_status(
                 "file_id": file_record["id"],
                 "filename": file_record["filename"],
                 "file_type": file_record.get("file_type", "unknown"),
-                "content_length": len(file_record.get("content", "")),
+                "content_length": file_record.get("content_length") or 0,
                 "created_at": file_record.get("created_at"),
                 "namespace": f"file_{file_record['filename']}"
             })
@@ -182,7 +204,7 @@ async def get_indexing_status(
         return IndexingStatusResponse(
             workspace_files_count=len(workspace_files),
             workspace_files=workspace_files,
-            user_id=current_user["id"],
+            user_id=current_user.id,
             workspace_id=workspace_id
         )
         
@@ -1,28 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File, Form, Header
+from typing import List, Optional
 import logging
 
-from app.dependencies import get_current_user
+from pydantic import BaseModel
+
+from app.config import settings
+from app.dependencies import get_current_user, get_file_service, get_upload_session_service
 from app.services.file_service import FileService
-from app.models.response import FileUploadResponse
+from app.services.upload_session_service import UploadSessionService
+from app.services.auth_service import UserInfo
+from app.models.response import BatchFileUploadResponse, FileUploadResponse
 from app.utils.exceptions import AppException
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int  # Total file size in bytes
+    workspace_id: Optional[str] = None
+
 @router.post("/upload", response_model=FileUploadResponse)
 async def upload_file(
     file: UploadFile = File(...),
     workspace_id: Optional[str] = Form(None),
-    current_user: dict = Depends(get_current_user)
+    current_user: UserInfo = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
 ):
     """Upload and convert document file to markdown, save to Supabase"""
     try:
-        file_service = FileService()
-        
         result = await file_service.process_upload(
             file=file,
-            user_id=current_user["id"],
+            user_id=current_user.id,
             workspace_id=workspace_id
         )
         
@@ -33,14 +42,120 @@ async def upload_file(
     except Exception as e:
         logger.error(f"Upload failed: {str(e)}")
         raise HTTPException(status_code=500, detail="File upload failed")
+
+@router.post("/upload/batch", response_model=BatchFileUploadResponse)
+async def upload_files(
+    files: List[UploadFile] = File(...),
+    workspace_id: Optional[str] = Form(None),
+    current_user: UserInfo = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
+):
+    """Upload and convert several documents at once, saving them with a single database insert"""
+    try:
+        if len(files) > settings.MAX_BATCH_FILES:
+            raise AppException(f"Too many files: at most {settings.MAX_BATCH_FILES} per batch", 413)
+        
+        results = await file_service.process_uploads(
+            files=files,
+            user_id=current_user.id,
+            workspace_id=workspace_id
+        )
+        
+        uploaded = sum(1 for result in results if result["success"])
+        return BatchFileUploadResponse(
+            success=uploaded == len(results),
+            results=results,
+            uploaded=uploaded,
+            failed=len(results) - uploaded
+        )
+        
+    except AppException as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    except Exception as e:
+        logger.error(f"Batch upload failed: {str(e)}")
+        raise HTTPException(status_code=500, detail="File upload failed")
+
+@router.post("/uploads", status_code=201)
+async def create_upload_session(
+    request: UploadSessionRequest,
+    current_user: UserInfo = Depends(get_current_user),
+    upload_sessions: UploadSessionService = Depends(get_upload_session_service)
+):
+    """Start a resumable upload; send the bytes with PATCH /uploads/{upload_id}"""
+    try:
+        return await upload_sessions.create_session(
+            filename=request.filename,
+            size=request.size,
+            user_id=current_user.id,
+            workspace_id=request.workspace_id
+        )
+    except AppException as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+
+@router.get("/uploads/{upload_id}")
+async def get_upload_session(
+    upload_id: str,
+    current_user: UserInfo = Depends(get_current_user),
+    upload_sessions: UploadSessionService = Depends(get_upload_session_service)
+):
+    """Get the received offset of a resumable upload"""
+    try:
+        return await upload_sessions.get_status(upload_id, current_user.id)
+    except AppException as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+
+@router.patch("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    content_range: Optional[str] = Header(None),
+    current_user: UserInfo = Depends(get_current_user),
+    upload_sessions: UploadSessionService = Depends(get_upload_session_service)
+):
+    """Append a byte range (Content-Range: bytes start-end/total) to a resumable upload"""
+    try:
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > settings.MAX_FILE_SIZE:
+            raise AppException("Chunk too large", 413)
+        
+        # Content-Length is absent with chunked transfer encoding, so count the bytes as they arrive
+        chunks, received = [], 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > settings.MAX_FILE_SIZE:
+                raise AppException("Chunk too large", 413)
+            chunks.append(chunk)
+        
+        return await upload_sessions.append_chunk(
+            upload_id, current_user.id, content_range, b"".join(chunks)
+        )
+    except AppException as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+
+@router.post("/uploads/{upload_id}/complete", response_model=FileUploadResponse)
+async def complete_upload(
+    upload_id: str,
+    current_user: UserInfo = Depends(get_current_user),
+    upload_sessions: UploadSessionService = Depends(get_upload_session_service)
+):
+    """Convert a fully received resumable upload to markdown and save it to Supabase"""
+    try:
+        result = await upload_sessions.complete(upload_id, current_user.id)
+        return FileUploadResponse(**result)
+    except AppException as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    except Exception as e:
+        logger.error(f"Upload completion failed: {str(e)}")
+        raise HTTPException(status_code=500, detail="File upload failed")
+
 @router.get("/files")
 async def get_user_files(
-    current_user: dict = Depends(get_current_user)
+    current_user: UserInfo = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
 ):
     """Get all converted files for the current user"""
     try:
-        file_service = FileService()
-        files = await file_service.get_user_files(current_user["id"])
+        files = await file_service.get_user_files(current_user.id)
         
         return {
             "success": True,
@@ -57,12 +172,12 @@ async def get_user_files(
 @router.get("/files/{file_id}")
 async def get_file(
     file_id: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: UserInfo = Depends(get_current_user),
+    file_service: FileService = Depends(get_file_service)
 ):
     """Get a specific converted file by ID"""
     try:
-        file_service = FileService()
-        file_data = await file_service.get_file_by_id(file_id, current_user["id"])
+        file_data = await file_service.get_file_by_id(file_id, current_user.id)
         
         return {
             "success": True,
@@ -3,16 +3,28 @@ API router for workspace-based agent interactions with Supabase integration.
 Handles authentication and workspace-scoped file operations.
 """
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
 from pydantic import BaseModel
 from typing import Optional
+import logging
+import re
 
-from app.dependencies import get_current_user
-from app.services.supabase_graph_agent_v2 import create_supabase_agent
+from app.dependencies import get_current_user, get_db_service
+from app.services.supabase_graph_agent_v2 import SmartSupabaseAgent, create_supabase_agent
 from app.services.database_service import DatabaseService
+from app.services.auth_service import UserInfo
 from app.utils.exceptions import AppException
 
 router = APIRouter(prefix="/workspace", tags=["workspace-agent"])
+logger = logging.getLogger(__name__)
+
+# Messages matching any of these keywords are treated as edit requests (requires editor role)
+_EDIT_RE = re.compile(r"edit|update|change|modify|rewrite|improve|add|remove|delete|review|fix", re.IGNORECASE)
+
+def _get_agent(workspace_id: str, user_id: str, model: Optional[str] = None) -> SmartSupabaseAgent:
+    """Create a workspace agent for one request. Agents keep conversation history, so they are
+    not shared; the Supabase client and per-model Groq clients they use are."""
+    return create_supabase_agent(workspace_id, user_id, model, get_db_service())
 
 class WorkspaceChatRequest(BaseModel):
     message: str
@@ -34,28 +46,22 @@ class WorkspaceStatusResponse(BaseModel):
 @router.post("/chat", response_model=WorkspaceChatResponse)
 async def chat_with_workspace_agent(
     request: WorkspaceChatRequest,
-    current_user: dict = Depends(get_current_user)
+    current_user: UserInfo = Depends(get_current_user),
+    db_service: DatabaseService = Depends(get_db_service)
 ):
     """
     Chat with the smart assistant in a specific workspace context.
     Requires JWT authentication and workspace access verification.
     """
     try:
-        user_id = current_user["id"]
+        user_id = current_user.id
         workspace_id = request.workspace_id
         
         # Verify user has access to the workspace (viewers can chat)
-        db_service = DatabaseService()
         access_info = await _verify_workspace_access(db_service, workspace_id, user_id, "viewer")
         
-        # Create workspace-scoped agent with optional model selection
-        agent = create_supabase_agent(workspace_id, user_id, request.model)
-        
         # Check if this is an edit request and verify editor permissions
-        message_lower = request.message.lower()
-        edit_keywords = ['edit', 'update', 'change', 'modify', 'rewrite', 'improve', 'add', 'remove', 'delete', 'review', 'fix']
-        
-        is_edit_request = any(keyword in message_lower for keyword in edit_keywords)
+        is_edit_request = bool(_EDIT_RE.search(request.message))
         
         if is_edit_request and access_info["role"] not in ["owner", "editor"]:
             raise HTTPException(
@@ -63,6 +69,9 @@ async def chat_with_workspace_agent(
                 detail="Edit operations require editor or owner permissions"
             )
         
+        # Create workspace-scoped agent with optional model selection (only once authorized)
+        agent = _get_agent(workspace_id, user_id, request.model)
+        
         # Get response from agent
         response = await agent.chat(request.message, request.filename)
         
@@ -79,24 +88,30 @@ async def chat_with_workspace_agent(
 @router.get("/status/{workspace_id}", response_model=WorkspaceStatusResponse)
 async def get_workspace_agent_status(
     workspace_id: str,
-    current_user: dict = Depends(get_current_user)
+    request: Request,
+    response: Response,
+    current_user: UserInfo = Depends(get_current_user),
+    db_service: DatabaseService = Depends(get_db_service)
 ):
-    """Get agent status for a specific workspace."""
+    """Get agent status for a specific workspace. Supports conditional requests via ETag."""
     try:
-        user_id = current_user["id"]
+        user_id = current_user.id
         
         # Verify workspace access (viewers can check status)
-        db_service = DatabaseService()
         access_info = await _verify_workspace_access(db_service, workspace_id, user_id, "viewer")
         
-        # Get workspace files count
-        files = await db_service.get_workspace_files(workspace_id, user_id)
+        # Get workspace files count and last change, and skip the body if the client is up to date
+        summary = await db_service.get_workspace_files_summary(workspace_id, user_id)
+        etag = f'W/"{workspace_id}-{summary["count"]}-{summary["last_updated_at"]}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
         
         return WorkspaceStatusResponse(
             status="active",
             workspace_id=workspace_id,
             user_id=user_id,
-            available_files=len(files),
+            available_files=summary["count"],
             agent_type="supabase_graph_based"
         )
     
@@ -108,14 +123,14 @@ async def get_workspace_agent_status(
 @router.get("/files/{workspace_id}")
 async def get_workspace_files(
     workspace_id: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: UserInfo = Depends(get_current_user),
+    db_service: DatabaseService = Depends(get_db_service)
 ):
     """Get all files in a workspace for the agent context."""
     try:
-        user_id = current_user["id"]
+        user_id = current_user.id
         
         # Verify workspace access (viewers can see files)
-        db_service = DatabaseService()
         access_info = await _verify_workspace_access(db_service, workspace_id, user_id, "viewer")
         
         # Get workspace files
@@ -146,19 +161,18 @@ async def get_workspace_files(
 async def get_workspace_file_content(
     workspace_id: str,
     filename: str,
-    current_user: dict = Depends(get_current_user)
+    current_user: UserInfo = Depends(get_current_user),
+    db_service: DatabaseService = Depends(get_db_service)
 ):
     """Get specific file content from workspace."""
     try:
-        user_id = current_user["id"]
+        user_id = current_user.id
         
         # Verify workspace access (viewers can read file content)
-        db_service = DatabaseService()
         access_info = await _verify_workspace_access(db_service, workspace_id, user_id, "viewer")
         
-        # Create agent to use its file finding logic
-        agent = create_supabase_agent(workspace_id, user_id)
-        file_data = await agent._find_file(filename)
+        # Look the file up directly, no agent needed
+        file_data = await db_service.find_workspace_file(workspace_id, user_id, filename)
         
         if not file_data:
             raise HTTPException(status_code=404, detail=f"File not found: {filename}")
@@ -183,17 +197,12 @@ async def get_workspace_file_content(
 async def _verify_workspace_access(db_service: DatabaseService, workspace_id: str, user_id: str, required_role: str = "viewer"):
     """Verify that the user has access to the workspace with the required role."""
     try:
-        print(f"🔍 Debug - Checking access for user {user_id} to workspace {workspace_id}")
+        # Resolve the effective role (owner or collaborator role) in a single query
+        user_role = await db_service.get_workspace_role(workspace_id, user_id)
         
-        # Check if user is in the collaborators table (which includes owner, editor, viewer)
-        collab_result = db_service.supabase.table("collaborators").select("role").eq("workspace_id", workspace_id).eq("user_id", user_id).execute()
+        logger.debug("Access check: user %s has role %s in workspace %s", user_id, user_role, workspace_id)
         
-        print(f"🔍 Debug - Collaborator check result: {collab_result.data}")
-        
-        if collab_result.data:
-            user_role = collab_result.data[0]["role"]
-            print(f"✅ User found with role: {user_role}")
-            
+        if user_role:
             # Define role hierarchy: owner > editor > viewer
             role_hierarchy = {"owner": 3, "editor": 2, "viewer": 1}
             
@@ -205,21 +214,11 @@ async def _verify_workspace_access(db_service: DatabaseService, workspace_id: st
             else:
                 raise AppException(f"Insufficient permissions. Required: {required_role}, User has: {user_role}", 403)
         
-        # Fallback: Check if user is the workspace owner (in case they're not in collaborators table)
-        owner_result = db_service.supabase.table("workspaces").select("id").eq("id", workspace_id).eq("owner_id", user_id).execute()
-        
-        print(f"🔍 Debug - Fallback owner check result: {owner_result.data}")
-        
-        if owner_result.data:
-            print(f"✅ User is workspace owner (fallback)")
-            return {"access": True, "role": "owner"}
-        
         # No access found
-        print(f"❌ No access found - user not found in collaborators or as owner")
         raise AppException("Workspace not found or access denied", 403)
         
     except AppException:
         raise
     except Exception as e:
-        print(f"❌ Access verification error: {str(e)}")
+        logger.error(f"Access verification error: {str(e)}")
         raise AppException("Failed to verify workspace access", 500, str(e))
\ No newline at end of file
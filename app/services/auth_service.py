@@ -1,39 +1,72 @@
 import jwt
-from typing import Dict, Any
+import hashlib
+import time
+from typing import Dict, Any, Optional
 import logging
+from dataclasses import dataclass
+
+from cachetools import TTLCache
+from fastapi.concurrency import run_in_threadpool
 
 from app.config import settings
 from app.utils.exceptions import AppException
 
 logger = logging.getLogger(__name__)
 
+# Validated tokens, keyed by SHA-256 of the raw token so the token itself is never held
+TOKEN_CACHE_TTL = 30  # seconds
+_token_cache: TTLCache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL)
+
+@dataclass(slots=True, frozen=True)
+class UserInfo:
+    """Authenticated user extracted from a validated token"""
+    id: str
+    email: Optional[str]
+    role: str
+
 class AuthService:
     def __init__(self):
         self.jwt_secret = settings.SUPABASE_JWT_SECRET
+        # Supabase always signs with HS256; the decoder and its options are set up once.
+        # Supabase tokens don't always have aud
+        self._jwt = jwt.PyJWT(options={"verify_aud": False})
 
-    async def validate_token(self, token: str) -> Dict[str, Any]:
+    async def validate_token(self, token: str) -> UserInfo:
         """Validate JWT token and return user info"""
+        cache_key = hashlib.sha256(token.encode()).hexdigest()
+        cached_user = _token_cache.get(cache_key)
+        if cached_user is not None:
+            return cached_user
+        
+        # Signature verification is CPU-bound, keep it off the event loop
+        payload = await run_in_threadpool(self._decode, token)
+        
+        if not payload.get("sub"):
+            raise AppException("Invalid token: missing user ID", 401)
+        
+        # Extract user info
+        user_info = UserInfo(
+            id=payload["sub"],
+            email=payload.get("email"),
+            role=payload.get("role", "authenticated")
+        )
+        
+        # Only cache tokens that outlive the cache entry, so an expired token is never served
+        exp = payload.get("exp")
+        if exp is not None and exp - time.time() > TOKEN_CACHE_TTL:
+            _token_cache[cache_key] = user_info
+        
+        return user_info
+
+    def _decode(self, token: str) -> Dict[str, Any]:
+        """Decode and verify JWT token (blocking)"""
         try:
-            # Decode JWT token
-            payload = jwt.decode(
-                token, 
-                self.jwt_secret, 
-                algorithms=["HS256"],
-                options={"verify_aud": False}  # Supabase tokens don't always have aud
-            )
-            
-            # Extract user info
-            user_info = {
-                "id": payload.get("sub"),
-                "email": payload.get("email"),
-                "role": payload.get("role", "authenticated")
-            }
-            
-            if not user_info["id"]:
-                raise AppException("Invalid token: missing user ID", 401)
-            
-            return user_info
-            
+            payload = self._jwt.decode(token, self.jwt_secret, algorithms=["HS256"])
+            # PyJWT coerces a string exp with int(); validate_token needs a NumericDate
+            exp = payload.get("exp")
+            if exp is not None and (isinstance(exp, bool) or not isinstance(exp, (int, float))):
+                raise jwt.DecodeError("Expiration Time claim (exp) must be a number")
+            return payload
         except jwt.ExpiredSignatureError:
             raise AppException("Token has expired", 401)
         except jwt.InvalidTokenError as e:
@@ -1,10 +1,13 @@
 import re
 import os
 import time
+import asyncio
 import json
 import hashlib
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Union
+from collections import Counter
 from dataclasses import dataclass
+from functools import lru_cache
 from enum import Enum
 from pinecone import Pinecone
 from dotenv import load_dotenv
@@ -13,6 +16,58 @@ import yaml
 # Load environment variables
 load_dotenv()
 
+# Pinecone upsert tuning: records per request, concurrent requests, retries on rate limiting (HTTP 429)
+UPSERT_BATCH_SIZE = 90
+UPSERT_CONCURRENCY = 8
+UPSERT_MAX_RETRIES = 5
+# Pinecone's limit on ids per delete request
+DELETE_BATCH_SIZE = 1000
+
+# Chunk ids are 12-byte blake2b digests in hex (see _assign_chunk_ids)
+_CHUNK_ID_RE = re.compile(r'[0-9a-f]{24}')
+
+@lru_cache(maxsize=1)
+def _load_config() -> Dict[str, Any]:
+    """Load configs/config.yaml once per process"""
+    with open("configs/config.yaml", "r") as f:
+        return yaml.safe_load(f)
+
+@lru_cache(maxsize=1)
+def _pinecone_client() -> Pinecone:
+    """Shared Pinecone client, so each chunker doesn't open its own connection"""
+    pinecone_api_key = os.getenv("PINECONE_API_KEY")
+    if not pinecone_api_key:
+        raise ValueError("Missing Pinecone API key")
+    return Pinecone(api_key=pinecone_api_key)
+
+@lru_cache(maxsize=8)
+def _get_index(index_name: str):
+    """Return the Pinecone index handle, creating the index on first use if needed"""
+    pinecone_env = _load_config()["vector_store"]["environment"]
+    if not pinecone_env:
+        raise ValueError("Missing Pinecone environment in config")
+    
+    pc = _pinecone_client()
+    
+    # Create index if it doesn't exist
+    if not pc.has_index(index_name):
+        pc.create_index_for_model(
+            name=index_name,
+            cloud="aws",
+            region=pinecone_env,
+            embed={
+                "model": "multilingual-e5-large",
+                "field_map": {"text": "chunk_text"}
+            }
+        )
+        # Poll with exponential backoff instead of a fixed one-second wait
+        delay = 0.2
+        while not pc.describe_index(index_name).status["ready"]:
+            time.sleep(delay)
+            delay = min(delay * 2, 5.0)
+    
+    return pc.Index(index_name)
+
 class ChunkType(Enum):
     SECTION = "section"
     SUBSECTION = "subsection" 
@@ -20,17 +75,31 @@ class ChunkType(Enum):
     LIST = "list"
     TABLE = "table"
 
-@dataclass
+# Plain string values, looked up per chunk when building records and stats
+_CHUNK_TYPE_VALUES = {t: t.value for t in ChunkType}
+
+# Line classification flags produced by MarkdownChunkerStorage._classify_lines
+_LINE_HEADER = 1
+_LINE_TABLE = 2  # contains '|'
+_LINE_LIST = 4
+_LINE_BLANK = 8
+_CONTENT_BOUNDARY = _LINE_HEADER | _LINE_TABLE | _LINE_LIST
+
+# First characters a stripped header / bullet list line can start with (numbered lists are checked with isdigit)
+_BOUNDARY_HINT = frozenset('#-*+')
+
+@dataclass(slots=True)
 class ChunkMetadata:
     chunk_id: str
     chunk_type: ChunkType
     filename: str  # Added filename field
     start_line: int
     end_line: int
-    section_path: List[str]
+    section_path: Tuple[str, ...]  # shared between chunks of the same section, never mutated
     section_level: int
+    section_label: str  # section_path joined with " > ", as stored in Pinecone
 
-@dataclass
+@dataclass(slots=True)
 class DocumentChunk:
     content: str
     metadata: ChunkMetadata
@@ -38,13 +107,19 @@ class DocumentChunk:
 class MarkdownChunkerStorage:
     def __init__(self, index_name: str = None, max_chunk_size: int = 800):
         self.max_chunk_size = max_chunk_size
-        self.index = self._get_vector_store(index_name)
+        self._index_name = index_name
+        self._index = None  # connected on first store, so chunking alone never touches Pinecone
         
         # Patterns for markdown elements
         self.header_pattern = re.compile(r'^(#{1,6})\s+(.+)$', re.MULTILINE)
         self.list_pattern = re.compile(r'^(\s*[-*+]|\s*\d+\.)\s+(.+)$', re.MULTILINE)
+        
+        # Compiled once: header title extraction, and a single header-or-list
+        # match for the per-line classification in _classify_lines (group 1 is set for headers)
+        self._header_line_re = re.compile(r'^(#{1,6})\s+(.+)$')
+        self._boundary_re = re.compile(r'^(?:(#{1,6})\s+.+$|(?:[-*+]|\d+\.)\s)')
     
-    def process_and_store_file(self, file_path: str, namespace: str = "") -> Dict[str, Any]:
+    async def process_and_store_file(self, file_path: str, namespace: str = "") -> Dict[str, Any]:
         """
         Process markdown file, chunk it, and store in Pinecone
         
@@ -55,17 +130,14 @@ class MarkdownChunkerStorage:
         Returns:
             Dictionary with processing results
         """
-        # Read file
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
         filename = os.path.basename(file_path)
         
-        # Chunk the markdown
-        chunks = self._chunk_document(content, filename)
+        # Read and chunk the markdown (blocking, keep it off the event loop)
+        loop = asyncio.get_running_loop()
+        chunks = await loop.run_in_executor(None, self._chunk_file, file_path, filename)
         
         # Store in Pinecone
-        self._store_chunks(chunks, namespace)
+        await self._store_chunks(chunks, namespace, filename)
         
         return {
             "filename": filename,
@@ -74,7 +146,7 @@ class MarkdownChunkerStorage:
             "status": "success"
         }
     
-    def process_and_store_content(self, content: str, namespace: str = "", filename: str = "document") -> Dict[str, Any]:
+    async def process_and_store_content(self, content: str, namespace: str = "", filename: str = "document") -> Dict[str, Any]:
         """
         Process markdown content directly, chunk it, and store in Pinecone
         
@@ -86,11 +158,12 @@ class MarkdownChunkerStorage:
         Returns:
             Dictionary with processing results
         """
-        # Chunk the markdown content
-        chunks = self._chunk_document(content, filename)
+        # Chunk the markdown content (CPU-bound, keep it off the event loop)
+        loop = asyncio.get_running_loop()
+        chunks = await loop.run_in_executor(None, self._chunk_document, content, filename)
         
         # Store in Pinecone
-        self._store_chunks(chunks, namespace)
+        await self._store_chunks(chunks, namespace, filename)
         
         return {
             "filename": filename,
@@ -99,136 +172,169 @@ class MarkdownChunkerStorage:
             "status": "success"
         }
     
+    @property
+    def index(self):
+        """Pinecone index, resolved lazily on first use"""
+        if self._index is None:
+            self._index = self._get_vector_store(self._index_name)
+        return self._index
+    
     def _get_vector_store(self, index_name: str = None) -> Pinecone:
         """Initialize Pinecone index"""
-        # Load config
-        with open("configs/config.yaml", "r") as f:
-            config = yaml.safe_load(f)
-        
-        pinecone_api_key = os.getenv("PINECONE_API_KEY")
-        pinecone_env = config["vector_store"]["environment"]
-        
-        if not pinecone_api_key:
-            raise ValueError("Missing Pinecone API key")
-        if not pinecone_env:
-            raise ValueError("Missing Pinecone environment in config")
-        
-        pc = Pinecone(api_key=pinecone_api_key)
-        index_name = index_name or config["vector_store"]["index_name"]
-        
-        # Create index if it doesn't exist
-        if not pc.has_index(index_name):
-            pc.create_index_for_model(
-                name=index_name,
-                cloud="aws",
-                region=pinecone_env,
-                embed={
-                    "model": "multilingual-e5-large",
-                    "field_map": {"text": "chunk_text"}
-                }
-            )
-            while not pc.describe_index(index_name).status["ready"]:
-                time.sleep(1)
-        
-        return pc.Index(index_name)
+        config = _load_config()
+        return _get_index(index_name or config["vector_store"]["index_name"])
+    
+    def _classify_lines(self, lines: List[str]) -> bytearray:
+        """Classify every line once, so chunk extraction never re-runs regexes on the same line"""
+        boundary_match = self._boundary_re.match
+        kinds = bytearray(len(lines))
+        
+        for i, line in enumerate(lines):
+            stripped = line.strip()
+            if not stripped:
+                kinds[i] = _LINE_BLANK
+                continue
+            
+            # Cheap first-character check keeps plain text lines away from the regex engine
+            kind = 0
+            first = stripped[0]
+            if first in _BOUNDARY_HINT or first.isdigit():
+                match = boundary_match(stripped)
+                if match:
+                    kind = _LINE_HEADER if match.group(1) else _LINE_LIST
+            if '|' in line:
+                kind |= _LINE_TABLE
+            kinds[i] = kind
+        
+        return kinds
+    
+    def _chunk_file(self, file_path: str, filename: str) -> List[DocumentChunk]:
+        """Chunk a markdown file, reading it line by line instead of loading it as one string"""
+        lines = []
+        last = '\n'
+        with open(file_path, 'r', encoding='utf-8', buffering=1 << 16) as f:
+            for last in f:
+                lines.append(last.rstrip('\n'))
+        
+        # Match str.split('\n'): a trailing newline (or an empty file) yields a final empty line
+        if last.endswith('\n'):
+            lines.append('')
+        
+        return self._chunk_document(lines, filename)
     
-    def _chunk_document(self, markdown_content: str, filename: str) -> List[DocumentChunk]:
-        """Chunk markdown document"""
-        lines = markdown_content.split('\n')
+    def _chunk_document(self, markdown_content: Union[str, List[str]], filename: str) -> List[DocumentChunk]:
+        """Chunk markdown document, given either the full text or its lines"""
+        if isinstance(markdown_content, str):
+            lines = markdown_content.split('\n')
+        else:
+            lines = markdown_content
+        kinds = self._classify_lines(lines)
         chunks = []
-        current_section_path = []
-        chunk_counter = 0
+        current_section_path = ()
+        current_section_label = ""
         
         i = 0
         while i < len(lines):
-            line = lines[i].strip()
+            kind = kinds[i]
             
             # Check for headers
-            header_match = re.match(r'^(#{1,6})\s+(.+)$', line)
-            if header_match:
+            if kind & _LINE_HEADER:
+                line = lines[i].strip()
+                header_match = self._header_line_re.match(line)
                 level = len(header_match.group(1))
                 title = header_match.group(2).strip()
                 
                 # Update section path
                 current_section_path = self._update_section_path(current_section_path, title, level)
+                current_section_label = " > ".join(current_section_path)
                 
                 # Create header chunk
                 chunk = DocumentChunk(
                     content=line,
                     metadata=ChunkMetadata(
-                        chunk_id=f"chunk_{chunk_counter}",
+                        chunk_id="",  # assigned by _assign_chunk_ids
                         chunk_type=ChunkType.SECTION if level <= 2 else ChunkType.SUBSECTION,
                         filename=filename,
                         start_line=i + 1,
                         end_line=i + 1,
-                        section_path=current_section_path.copy(),
-                        section_level=level
+                        section_path=current_section_path,
+                        section_level=level,
+                        section_label=current_section_label
                     )
                 )
                 chunks.append(chunk)
-                chunk_counter += 1
                 i += 1
                 continue
             
             # Check for tables
-            if '|' in line and i < len(lines) - 1:
+            if kind & _LINE_TABLE and i < len(lines) - 1:
                 table_chunk, lines_consumed = self._extract_table_chunk(
-                    lines, i, current_section_path, chunk_counter, filename
+                    lines, kinds, i, current_section_path, current_section_label, filename
                 )
                 if table_chunk:
                     chunks.append(table_chunk)
-                    chunk_counter += 1
                     i += lines_consumed
                     continue
             
             # Check for lists
-            if re.match(r'^(\s*[-*+]|\s*\d+\.)\s+', line):
+            if kind & _LINE_LIST:
                 list_chunk, lines_consumed = self._extract_list_chunk(
-                    lines, i, current_section_path, chunk_counter, filename
+                    lines, kinds, i, current_section_path, current_section_label, filename
                 )
                 if list_chunk:
                     chunks.append(list_chunk)
-                    chunk_counter += 1
                     i += lines_consumed
                     continue
             
             # Regular content
-            if line:
+            if not kind & _LINE_BLANK:
                 content_chunk, lines_consumed = self._extract_content_chunk(
-                    lines, i, current_section_path, chunk_counter, filename
+                    lines, kinds, i, current_section_path, current_section_label, filename
                 )
                 if content_chunk:
                     chunks.append(content_chunk)
-                    chunk_counter += 1
                     i += lines_consumed
                     continue
             
             i += 1
         
+        self._assign_chunk_ids(chunks)
         return chunks
     
-    def _update_section_path(self, current_path: List[str], title: str, level: int) -> List[str]:
+    def _assign_chunk_ids(self, chunks: List[DocumentChunk]):
+        """Content-address chunks, so re-ingesting an unchanged document upserts the same ids.
+        Repeated content within a document gets its occurrence number mixed in to keep ids unique."""
+        seen = Counter()
+        for chunk in chunks:
+            data = chunk.content.encode('utf-8')
+            occurrence = seen[data]
+            seen[data] += 1
+            if occurrence:
+                data += f"\x00{occurrence}".encode('ascii')
+            chunk.metadata.chunk_id = hashlib.blake2b(data, digest_size=12).hexdigest()
+    
+    def _update_section_path(self, current_path: Tuple[str, ...], title: str, level: int) -> Tuple[str, ...]:
         """Update section hierarchy path"""
         if level == 1:
-            return [title]
+            return (title,)
         elif level == 2:
-            return [title]
+            return (title,)
         else:
             if len(current_path) >= 1:
-                return [current_path[0], title]
+                return (current_path[0], title)
             else:
-                return [title]
+                return (title,)
     
-    def _extract_table_chunk(self, lines: List[str], start_idx: int, 
-                           section_path: List[str], chunk_id: int, filename: str) -> Tuple[Optional[DocumentChunk], int]:
+    def _extract_table_chunk(self, lines: List[str], kinds: bytearray, start_idx: int, 
+                           section_path: Tuple[str, ...], section_label: str, filename: str) -> Tuple[Optional[DocumentChunk], int]:
         """Extract table as a single chunk"""
         table_lines = []
         i = start_idx
         
-        while i < len(lines) and ('|' in lines[i] or lines[i].strip() == ''):
-            if '|' in lines[i]:
+        while i < len(lines) and kinds[i] & (_LINE_TABLE | _LINE_BLANK):
+            if kinds[i] & _LINE_TABLE:
                 table_lines.append(lines[i])
-            elif lines[i].strip() == '' and table_lines:
+            elif table_lines:
                 break
             i += 1
         
@@ -240,31 +346,31 @@ class MarkdownChunkerStorage:
         chunk = DocumentChunk(
             content=content,
             metadata=ChunkMetadata(
-                chunk_id=f"chunk_{chunk_id}",
+                chunk_id="",  # assigned by _assign_chunk_ids
                 chunk_type=ChunkType.TABLE,
                 filename=filename,
                 start_line=start_idx + 1,
                 end_line=start_idx + len(table_lines),
-                section_path=section_path.copy(),
-                section_level=0
+                section_path=section_path,
+                section_level=0,
+                section_label=section_label
             )
         )
         
         return chunk, len(table_lines)
     
-    def _extract_list_chunk(self, lines: List[str], start_idx: int,
-                          section_path: List[str], chunk_id: int, filename: str) -> Tuple[Optional[DocumentChunk], int]:
+    def _extract_list_chunk(self, lines: List[str], kinds: bytearray, start_idx: int,
+                          section_path: Tuple[str, ...], section_label: str, filename: str) -> Tuple[Optional[DocumentChunk], int]:
         """Extract list as a single chunk"""
         list_lines = []
         i = start_idx
         
         while i < len(lines):
-            line = lines[i].strip()
-            if not line:
+            if kinds[i] & _LINE_BLANK:
                 i += 1
                 continue
                 
-            if re.match(r'^(\s*)([-*+]|\d+\.)\s+(.+)$', line):
+            if kinds[i] & _LINE_LIST:
                 list_lines.append(lines[i])
                 i += 1
             else:
@@ -278,48 +384,51 @@ class MarkdownChunkerStorage:
         chunk = DocumentChunk(
             content=content,
             metadata=ChunkMetadata(
-                chunk_id=f"chunk_{chunk_id}",
+                chunk_id="",  # assigned by _assign_chunk_ids
                 chunk_type=ChunkType.LIST,
                 filename=filename,
                 start_line=start_idx + 1,
                 end_line=start_idx + len(list_lines),
-                section_path=section_path.copy(),
-                section_level=0
+                section_path=section_path,
+                section_level=0,
+                section_label=section_label
             )
         )
         
         return chunk, len(list_lines)
     
-    def _extract_content_chunk(self, lines: List[str], start_idx: int,
-                             section_path: List[str], chunk_id: int, filename: str) -> Tuple[Optional[DocumentChunk], int]:
+    def _extract_content_chunk(self, lines: List[str], kinds: bytearray, start_idx: int,
+                             section_path: Tuple[str, ...], section_label: str, filename: str) -> Tuple[Optional[DocumentChunk], int]:
         """Extract regular content chunk"""
         content_lines = []
+        content_end = 0  # length of content_lines up to the last non-blank line
         current_size = 0
+        max_size = self.max_chunk_size
+        n_lines = len(lines)
         i = start_idx
         
-        while i < len(lines) and current_size < self.max_chunk_size:
-            line = lines[i]
+        while i < n_lines and current_size < max_size:
+            kind = kinds[i]
             
             # Stop at headers, lists, or tables
-            if (re.match(r'^#{1,6}\s+', line.strip()) or 
-                re.match(r'^(\s*[-*+]|\s*\d+\.)\s+', line.strip()) or 
-                '|' in line):
+            if kind & _CONTENT_BOUNDARY:
                 break
             
-            if line.strip():
+            if not kind & _LINE_BLANK:
+                line = lines[i]
                 content_lines.append(line)
+                content_end = len(content_lines)
                 current_size += len(line)
             elif content_lines:
-                content_lines.append(line)
+                content_lines.append(lines[i])
             
             i += 1
         
         if not content_lines:
             return None, 1
         
-        # Clean up trailing empty lines
-        while content_lines and not content_lines[-1].strip():
-            content_lines.pop()
+        # Clean up trailing empty lines (already known from classification)
+        del content_lines[content_end:]
         
         if not content_lines:
             return None, i - start_idx
@@ -329,52 +438,89 @@ class MarkdownChunkerStorage:
         chunk = DocumentChunk(
             content=content,
             metadata=ChunkMetadata(
-                chunk_id=f"chunk_{chunk_id}",
+                chunk_id="",  # assigned by _assign_chunk_ids
                 chunk_type=ChunkType.CONTENT,
                 filename=filename,
                 start_line=start_idx + 1,
                 end_line=start_idx + len(content_lines),
-                section_path=section_path.copy(),
-                section_level=0
+                section_path=section_path,
+                section_level=0,
+                section_label=section_label
             )
         )
         
         return chunk, len(content_lines)
     
-    def _store_chunks(self, chunks: List[DocumentChunk], namespace: str):
-        """Store chunks in Pinecone"""
+    async def _store_chunks(self, chunks: List[DocumentChunk], namespace: str, filename: str):
+        """Store chunks in Pinecone, then delete the document's chunks from earlier versions"""
+        loop = asyncio.get_running_loop()
+        # The first access may create the index and wait for it, so resolve it off the event loop
+        index = self._index or await loop.run_in_executor(None, lambda: self.index)
+        
+        if not chunks:
+            await loop.run_in_executor(None, self._delete_stale_chunks, index, namespace, filename, set())
+            return
+        
         records = []
+        timestamp = int(time.time())  # one timestamp for the whole document
         
         for chunk in chunks:
-            record = {
-                "_id": f"{chunk.metadata.filename}_{chunk.metadata.chunk_id}",
-                "chunk_text": chunk.content,
-                "filename": chunk.metadata.filename,
-                "chunk_id": chunk.metadata.chunk_id,
-                "chunk_type": chunk.metadata.chunk_type.value,
-                "start_line": chunk.metadata.start_line,
-                "end_line": chunk.metadata.end_line,
-                "section_path": " > ".join(chunk.metadata.section_path),
-                "section_level": chunk.metadata.section_level,
-                "content_length": len(chunk.content),
-                "timestamp": int(time.time())
-            }
-            records.append(record)
-        
-        # Upsert in batches
-        batch_size = 90
-        for i in range(0, len(records), batch_size):
-            batch = records[i:i + batch_size]
-            self.index.upsert_records(namespace, batch)
-            time.sleep(1)
+            metadata = chunk.metadata
+            content = chunk.content
+            records.append({
+                "_id": f"{metadata.filename}_{metadata.chunk_id}",
+                "chunk_text": content,
+                "filename": metadata.filename,
+                "chunk_id": metadata.chunk_id,
+                "chunk_type": _CHUNK_TYPE_VALUES[metadata.chunk_type],
+                "start_line": metadata.start_line,
+                "end_line": metadata.end_line,
+                "section_path": metadata.section_label,
+                "section_level": metadata.section_level,
+                "content_length": len(content),
+                "timestamp": timestamp
+            })
+        
+        # Upsert batches concurrently, backing off only when Pinecone rate-limits us
+        semaphore = asyncio.Semaphore(UPSERT_CONCURRENCY)
+        
+        async def upsert_batch(batch: List[Dict[str, Any]]):
+            async with semaphore:
+                for attempt in range(UPSERT_MAX_RETRIES + 1):
+                    try:
+                        await loop.run_in_executor(None, index.upsert_records, namespace, batch)
+                        return
+                    except Exception as e:
+                        if getattr(e, "status", None) != 429 or attempt == UPSERT_MAX_RETRIES:
+                            raise
+                        await asyncio.sleep(min(2 ** attempt * 0.1, 5.0))
+        
+        await asyncio.gather(*(
+            upsert_batch(records[i:i + UPSERT_BATCH_SIZE])
+            for i in range(0, len(records), UPSERT_BATCH_SIZE)
+        ))
+        
+        # Ids are content addresses, so chunks that changed or disappeared are left behind under
+        # their old ids. Deleting them after the upsert keeps the document searchable throughout.
+        keep_ids = {record["_id"] for record in records}
+        await loop.run_in_executor(None, self._delete_stale_chunks, index, namespace, filename, keep_ids)
+    
+    def _delete_stale_chunks(self, index, namespace: str, filename: str, keep_ids: set):
+        """Delete a document's records that are not in keep_ids (blocking)"""
+        prefix = f"{filename}_"
+        stale = [
+            record_id
+            for page in index.list(prefix=prefix, namespace=namespace)
+            for record_id in page
+            # The prefix also matches other documents whose names extend this one ("a_b.md" for "a")
+            if record_id not in keep_ids and _CHUNK_ID_RE.fullmatch(record_id[len(prefix):])
+        ]
+        for i in range(0, len(stale), DELETE_BATCH_SIZE):
+            index.delete(ids=stale[i:i + DELETE_BATCH_SIZE], namespace=namespace)
     
     def _get_chunk_type_stats(self, chunks: List[DocumentChunk]) -> Dict[str, int]:
         """Get statistics about chunk types"""
-        stats = {}
-        for chunk in chunks:
-            chunk_type = chunk.metadata.chunk_type.value
-            stats[chunk_type] = stats.get(chunk_type, 0) + 1
-        return stats
+        return dict(Counter(_CHUNK_TYPE_VALUES[chunk.metadata.chunk_type] for chunk in chunks))
 
 
 # Usage example
@@ -383,10 +529,10 @@ if __name__ == "__main__":
     chunker = MarkdownChunkerStorage("hr-policy-index")
     
     # Process and store a markdown file
-    result = chunker.process_and_store_file(
+    result = asyncio.run(chunker.process_and_store_file(
         file_path="converted_markdown\hr2.md",
         namespace="documents"
-    )
+    ))
     
     print("Processing Results:")
     print(f"Filename: {result['filename']}")
@@ -1,14 +1,36 @@
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from datetime import datetime
-import uuid
 
+from cachetools import TTLCache
 from supabase import create_client, Client
 from app.config import settings
 from app.utils.exceptions import AppException
 
 logger = logging.getLogger(__name__)
 
+# Effective workspace roles, keyed by (workspace_id, user_id). Only grants are cached.
+# Memberships are changed outside this service (directly in Supabase), so a changed or
+# revoked role can keep working here for up to ROLE_CACHE_TTL.
+ROLE_CACHE_TTL = 30  # seconds
+_role_cache: TTLCache = TTLCache(maxsize=10000, ttl=ROLE_CACHE_TTL)
+
+# File rows by id for get_file_by_id; ownership is checked against the cached row
+FILE_CACHE_TTL = 60  # seconds
+_file_cache: TTLCache = TTLCache(maxsize=1024, ttl=FILE_CACHE_TTL)
+
+# Default workspace per user, for uploads that don't name a workspace
+DEFAULT_WORKSPACE_CACHE_TTL = 300  # seconds
+_default_workspace_cache: TTLCache = TTLCache(maxsize=10000, ttl=DEFAULT_WORKSPACE_CACHE_TTL)
+
+# Columns returned for a newly saved file. Inserts would otherwise echo the whole
+# markdown body back from Postgres; callers only need the row's identity.
+SAVED_FILE_COLUMNS = "id, workspace_id, filename, file_type, content_length, created_by, created_at"
+
+def invalidate_file(file_id: str):
+    """Drop a cached file row after its content changes"""
+    _file_cache.pop(file_id, None)
+
 class DatabaseService:
     """Database service for saving converted files to Supabase"""
     
@@ -20,11 +42,16 @@ class DatabaseService:
 
     async def get_or_create_default_workspace(self, user_id: str) -> str:
         """Get or create a default workspace for the user"""
+        cached_id = _default_workspace_cache.get(user_id)
+        if cached_id is not None:
+            return cached_id
+        
         try:
             # Try to get existing workspace owned by user
             result = self.supabase.table("workspaces").select("id").eq("owner_id", user_id).limit(1).execute()
             
             if result.data:
+                _default_workspace_cache[user_id] = result.data[0]["id"]
                 return result.data[0]["id"]
             
             # Create a default workspace if none exists
@@ -37,6 +64,7 @@ class DatabaseService:
             workspace_result = self.supabase.table("workspaces").insert(workspace_data).execute()
             
             if workspace_result.data:
+                _default_workspace_cache[user_id] = workspace_result.data[0]["id"]
                 return workspace_result.data[0]["id"]
             else:
                 # If workspace creation fails, return None to skip workspace_id
@@ -46,13 +74,35 @@ class DatabaseService:
             logger.warning(f"Could not create workspace for user {user_id}: {str(e)}")
             return None
 
+    async def get_workspace_role(self, workspace_id: str, user_id: str) -> Optional[str]:
+        """Get the user's effective role in a workspace (owner/editor/viewer), or None"""
+        cache_key = (workspace_id, user_id)
+        cached_role = _role_cache.get(cache_key)
+        if cached_role is not None:
+            return cached_role
+        
+        try:
+            result = self.supabase.rpc(
+                "workspace_effective_role",
+                {"p_workspace_id": workspace_id, "p_user_id": user_id}
+            ).execute()
+            role = result.data or None
+        except Exception as e:
+            logger.error(f"Failed to resolve workspace role: {str(e)}")
+            raise AppException("Failed to verify workspace access", 500, str(e))
+        
+        if role:
+            _role_cache[cache_key] = role
+        return role
+
     async def save_converted_file(
         self,
         filename: str,
         file_type: str,
         content: str,
         user_id: str,
-        workspace_id: str = None
+        workspace_id: str = None,
+        source_hash: str = None
     ) -> Dict[str, Any]:
         """Save converted markdown file to Supabase"""
         try:
@@ -71,9 +121,11 @@ class DatabaseService:
                 "created_by": user_id,
                 "workspace_id": workspace_id
             }
+            if source_hash:
+                file_data["source_hash"] = source_hash
             
             # Insert into Supabase
-            result = self.supabase.table("files").insert(file_data).execute()
+            result = self.supabase.table("files").insert(file_data).select(SAVED_FILE_COLUMNS).execute()
             
             if result.data:
                 logger.info(f"Saved converted file {filename} for user {user_id}")
@@ -82,13 +134,69 @@ class DatabaseService:
                 raise AppException("Failed to save file to database", 500)
                 
         except Exception as e:
+            # The cached default workspace may have been deleted; look it up again next time
+            _default_workspace_cache.pop(user_id, None)
             logger.error(f"Database save failed: {str(e)}")
             raise AppException("Database operation failed", 500, str(e))
 
-    async def get_user_files(self, user_id: str) -> list:
+    async def save_converted_files_bulk(
+        self,
+        files: List[Dict[str, str]],
+        user_id: str,
+        workspace_id: str = None
+    ) -> List[Dict[str, Any]]:
+        """Save several converted markdown files (filename, file_type, content) to Supabase in one insert"""
+        try:
+            # Get or create a workspace if none provided
+            if not workspace_id:
+                workspace_id = await self.get_or_create_default_workspace(user_id)
+            
+            # Ensure we have a workspace_id (required by schema)
+            if not workspace_id:
+                raise AppException("Could not create or find workspace for user", 500)
+            
+            rows = [
+                {**file, "created_by": user_id, "workspace_id": workspace_id}
+                for file in files
+            ]
+            
+            # Insert into Supabase; rows come back in insert order
+            result = self.supabase.table("files").insert(rows).select(SAVED_FILE_COLUMNS).execute()
+            
+            if result.data and len(result.data) == len(rows):
+                logger.info(f"Saved {len(rows)} converted files for user {user_id}")
+                return result.data
+            else:
+                raise AppException("Failed to save files to database", 500)
+                
+        except Exception as e:
+            _default_workspace_cache.pop(user_id, None)
+            logger.error(f"Database bulk save failed: {str(e)}")
+            raise AppException("Database operation failed", 500, str(e))
+
+    async def find_converted_content(self, source_hash: str, filename: str, user_id: str) -> Optional[str]:
+        """Markdown the user previously converted from the same uploaded document (same bytes and name), if any.
+        Only the caller's own files are searched, so reuse reveals nothing about other users' uploads."""
+        try:
+            result = (
+                self.supabase.table("files")
+                .select("content")
+                .eq("source_hash", source_hash)
+                .eq("filename", filename)
+                .eq("created_by", user_id)
+                .limit(1)
+                .execute()
+            )
+            return result.data[0]["content"] if result.data else None
+        except Exception as e:
+            # A failed lookup only costs a conversion
+            logger.warning(f"Converted content lookup failed: {str(e)}")
+            return None
+
+    async def get_user_files(self, user_id: str, columns: str = "*") -> list:
         """Get all converted files for a user"""
         try:
-            result = self.supabase.table("files").select("*").eq("created_by", user_id).execute()
+            result = self.supabase.table("files").select(columns).eq("created_by", user_id).execute()
             return result.data if result.data else []
         except Exception as e:
             logger.error(f"Failed to get user files: {str(e)}")
@@ -96,10 +204,15 @@ class DatabaseService:
 
     async def get_file_by_id(self, file_id: str, user_id: str) -> Dict[str, Any]:
         """Get a specific file by ID (with user verification)"""
+        cached_file = _file_cache.get(file_id)
+        if cached_file is not None and cached_file["created_by"] == user_id:
+            return cached_file
+        
         try:
             result = self.supabase.table("files").select("*").eq("id", file_id).eq("created_by", user_id).execute()
             
             if result.data:
+                _file_cache[file_id] = result.data[0]
                 return result.data[0]
             else:
                 raise AppException("File not found", 404)
@@ -110,43 +223,64 @@ class DatabaseService:
             logger.error(f"Failed to get file: {str(e)}")
             raise AppException("Failed to retrieve file", 500, str(e))   
             
-    async def get_workspace_files(self, workspace_id: str, user_id: str) -> list:
+    async def get_workspace_files(self, workspace_id: str, user_id: str, columns: str = "*") -> list:
         """Get all files in a specific workspace (with user verification)"""
         try:
-            print(f"🔍 DB Debug - Getting files for user {user_id} in workspace {workspace_id}")
-            
-            # Check if user is in the collaborators table (includes owner, editor, viewer)
-            collab_result = self.supabase.table("collaborators").select("role").eq("workspace_id", workspace_id).eq("user_id", user_id).execute()
-            
-            print(f"🔍 DB Debug - Collaborator check: {collab_result.data}")
-            
-            has_access = False
-            
-            if collab_result.data:
-                has_access = True
-                user_role = collab_result.data[0]['role']
-                print(f"✅ DB Debug - User found with role: {user_role}")
-            else:
-                # Fallback: Check if user is the workspace owner (in case they're not in collaborators table)
-                workspace_result = self.supabase.table("workspaces").select("id").eq("id", workspace_id).eq("owner_id", user_id).execute()
-                
-                print(f"🔍 DB Debug - Fallback owner check: {workspace_result.data}")
-                
-                if workspace_result.data:
-                    has_access = True
-                    print(f"✅ DB Debug - User is workspace owner (fallback)")
-            
-            if not has_access:
-                print(f"❌ DB Debug - No access found")
-                raise AppException("Workspace not found or access denied", 404)
-            
-            # Get files in the workspace
-            result = self.supabase.table("files").select("*").eq("workspace_id", workspace_id).execute()
-            print(f"🔍 DB Debug - Files found: {len(result.data) if result.data else 0}")
-            return result.data if result.data else []
-            
-        except AppException:
-            raise
+            # Access check and file fetch in one round trip
+            result = (
+                self.supabase.rpc(
+                    "get_workspace_files_for_user",
+                    {"p_workspace_id": workspace_id, "p_user_id": user_id}
+                )
+                .select(columns)
+                .execute()
+            )
         except Exception as e:
             logger.error(f"Failed to get workspace files: {str(e)}")
+            raise AppException("Failed to retrieve workspace files", 500, str(e))
+        
+        if result.data:
+            return result.data
+        
+        # Empty result: either the workspace has no files or the user has no access
+        if not await self.get_workspace_role(workspace_id, user_id):
+            raise AppException("Workspace not found or access denied", 404)
+        return []
+
+    async def find_workspace_file(self, workspace_id: str, user_id: str, filename: str) -> Optional[Dict[str, Any]]:
+        """Find a file in a workspace by exact name, falling back to a case-insensitive partial match"""
+        if not await self.get_workspace_role(workspace_id, user_id):
+            raise AppException("Workspace not found or access denied", 404)
+        
+        try:
+            result = self.supabase.table("files").select("*").eq("workspace_id", workspace_id).eq("filename", filename).limit(1).execute()
+            if result.data:
+                return result.data[0]
+            
+            result = self.supabase.table("files").select("*").eq("workspace_id", workspace_id).ilike("filename", f"%{filename}%").limit(1).execute()
+            return result.data[0] if result.data else None
+        except Exception as e:
+            logger.error(f"Failed to find workspace file: {str(e)}")
+            raise AppException("Failed to retrieve file", 500, str(e))
+
+    async def get_workspace_files_summary(self, workspace_id: str, user_id: str) -> Dict[str, Any]:
+        """Get file count and latest update time for a workspace (with user verification), without fetching rows"""
+        if not await self.get_workspace_role(workspace_id, user_id):
+            raise AppException("Workspace not found or access denied", 404)
+        
+        try:
+            result = (
+                self.supabase.table("files")
+                .select("updated_at", count="exact")
+                .eq("workspace_id", workspace_id)
+                .order("updated_at", desc=True)
+                .limit(1)
+                .execute()
+            )
+            return {
+                "count": result.count or 0,
+                "last_updated_at": result.data[0]["updated_at"] if result.data else None
+            }
+        except Exception as e:
+            logger.error(f"Failed to summarize workspace files: {str(e)}")
             raise AppException("Failed to retrieve workspace files", 500, str(e))
\ No newline at end of file
@@ -1,24 +1,85 @@
 import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+from typing import BinaryIO, Union
 import asyncio
+import io
+import multiprocessing
 import os
+import re
+import zipfile
 
+from app.config import settings
 from app.utils.exceptions import AppException
 
 logger = logging.getLogger(__name__)
 
+# DOCX bodies at least this large (uncompressed word/document.xml) are streamed
+# paragraph by paragraph instead of going through mammoth's HTML round trip
+DOCX_STREAMING_MIN_BYTES = 1024 * 1024
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Constructs the streaming parser can't render faithfully; seeing one hands the file to mammoth
+_DOCX_COMPLEX_TAGS = frozenset((f"{_W}tbl", f"{_W}drawing", f"{_W}pict", f"{_W}object"))
+_HEADING_STYLE_RE = re.compile(r'^Heading([1-6])$')
+
+# A document on disk, or an open binary file object (e.g. an upload's spooled file)
+DocumentSource = Union[Path, BinaryIO]
+
+def _rewind(source: DocumentSource) -> DocumentSource:
+    """Seek file objects back to the start so each reader sees the whole document"""
+    if not isinstance(source, Path):
+        source.seek(0)
+    return source
+
+def wrap_text_bytes(name: str, data: bytes) -> str:
+    """Wrap raw text file bytes as a markdown document titled `name`"""
+    try:
+        content = data.decode('utf-8')
+    except UnicodeDecodeError:
+        # Try with different encoding
+        content = data.decode('latin-1')
+    
+    # Same newline handling as reading the file in text mode
+    content = content.replace('\r\n', '\n').replace('\r', '\n')
+    
+    if not content.strip():
+        raise AppException("Text file is empty", 400)
+    
+    return f"# {name}\n\n{content}"
+
+# Converter owned by a conversion worker process, created on its first job
+_worker_converter = None
+
+def _convert_in_worker(source: Union[Path, bytes], filename: str) -> str:
+    """Process pool entry point; uploads arrive as bytes since file objects can't cross processes"""
+    global _worker_converter
+    if _worker_converter is None:
+        _worker_converter = DocumentConverter(executor_kind="inline")
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    return _worker_converter._convert_sync(source, filename)
+
 class DocumentConverter:
     """Service for converting documents to markdown using PyMuPDF, python-docx, and mammoth"""
     
-    def __init__(self):
+    def __init__(self, executor_kind: str = None):
+        """executor_kind: "process" (default, see CONVERSION_EXECUTOR), "thread", or "inline" for no pool"""
+        self.executor_kind = executor_kind or settings.CONVERSION_EXECUTOR
         try:
             import fitz  # PyMuPDF
             from docx import Document
+            from lxml import etree
             import mammoth
             
             self.fitz = fitz
             self.Document = Document
+            self.etree = etree
             self.mammoth = mammoth
+            
+            # Dedicated pool so large conversions can't starve the default executor
+            self._executor = self._create_executor()
             logger.info("Document converter initialized successfully")
         except ImportError as e:
             logger.error(f"Required libraries not installed: {str(e)}")
@@ -27,42 +88,60 @@ class DocumentConverter:
             logger.error(f"Failed to initialize document converter: {str(e)}")
             raise AppException("Failed to initialize document converter", 500, str(e))
 
+    def _create_executor(self):
+        """Conversion pool; processes let CPU-bound conversions (mammoth, PyMuPDF) use more than one core"""
+        if self.executor_kind == "inline":
+            return None
+        if self.executor_kind == "process":
+            # spawn: forking a process that already runs an event loop and HTTP clients is unsafe
+            return ProcessPoolExecutor(
+                max_workers=settings.CONVERSION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return ThreadPoolExecutor(
+            max_workers=settings.CONVERSION_WORKERS,
+            thread_name_prefix="document-converter"
+        )
+
     async def convert_to_markdown(self, file_path: Path) -> str:
         """Convert document to markdown format"""
+        return await self._convert(file_path, file_path.name)
+
+    async def convert_to_markdown_stream(self, fileobj: BinaryIO, filename: str) -> str:
+        """Convert an open binary file object to markdown without writing it to disk"""
+        return await self._convert(fileobj, filename)
+
+    async def _convert(self, source: DocumentSource, filename: str) -> str:
+        """Convert a document from a path or file object, picking the converter by filename extension"""
         try:
-            file_ext = file_path.suffix.lower()
+            file_ext = Path(filename).suffix.lower()
             
             # Validate file type
             if file_ext not in ['.pdf', '.docx', '.doc', '.txt']:
                 raise AppException(f"Unsupported file type: {file_ext}", 400)
             
-            # Run conversion in thread pool to avoid blocking
-            def _convert_sync():
+            # Run the synchronous conversion in the converter's pool to avoid blocking
+            loop = asyncio.get_running_loop()
+            if isinstance(self._executor, ProcessPoolExecutor):
+                payload = source if isinstance(source, Path) else await asyncio.to_thread(lambda: _rewind(source).read())
                 try:
-                    if file_ext == '.pdf':
-                        return self._convert_pdf(file_path)
-                    elif file_ext == '.docx':
-                        return self._convert_docx(file_path)
-                    elif file_ext == '.doc':
-                        return self._convert_doc(file_path)
-                    elif file_ext == '.txt':
-                        return self._convert_txt(file_path)
-                except Exception as e:
-                    logger.error(f"Document conversion failed for {file_path}: {str(e)}")
-                    raise AppException(f"Document conversion failed: {str(e)}", 500)
-            
-            # Run the synchronous conversion in a thread pool
-            loop = asyncio.get_event_loop()
-            markdown_content = await loop.run_in_executor(None, _convert_sync)
+                    markdown_content = await loop.run_in_executor(self._executor, _convert_in_worker, payload, filename)
+                except BrokenProcessPool:
+                    # A worker died (e.g. a crash inside a native parser); replace the pool for later requests
+                    logger.error(f"Conversion worker crashed on {filename}, restarting the pool")
+                    self._executor = self._create_executor()
+                    raise
+            else:
+                markdown_content = await loop.run_in_executor(self._executor, self._convert_sync, source, filename)
             
             if not markdown_content or markdown_content.strip() == "":
                 raise AppException("Document conversion resulted in empty content", 500)
             
-            logger.info(f"Successfully converted {file_path.name} to markdown")
+            logger.info(f"Successfully converted {filename} to markdown")
             return markdown_content
                 
         except FileNotFoundError:
-            logger.error(f"File not found: {file_path}")
+            logger.error(f"File not found: {source}")
             raise AppException("File not found", 404)
         except AppException:
             raise
@@ -70,80 +149,158 @@ class DocumentConverter:
             logger.error(f"Document conversion failed: {str(e)}")
             raise AppException("Document conversion failed", 500, str(e))
 
-    def _convert_pdf(self, file_path: Path) -> str:
+    def _convert_sync(self, source: DocumentSource, filename: str) -> str:
+        """Run the converter for the file's extension (blocking)"""
+        name = Path(filename)
+        file_ext = name.suffix.lower()
+        try:
+            if file_ext == '.pdf':
+                return self._convert_pdf(source, name.stem)
+            elif file_ext == '.docx':
+                return self._convert_docx(source, name.stem)
+            elif file_ext == '.doc':
+                return self._convert_doc(source, name.stem)
+            elif file_ext == '.txt':
+                return self._convert_txt(source, name.stem)
+        except Exception as e:
+            logger.error(f"Document conversion failed for {filename}: {str(e)}")
+            raise AppException(f"Document conversion failed: {str(e)}", 500)
+
+    def convert_bytes_to_markdown(self, name: str, data: bytes, file_ext: str) -> str:
+        """Convert an in-memory document to markdown, for formats that need no conversion library"""
+        if file_ext != '.txt':
+            raise AppException(f"In-memory conversion not supported for: {file_ext}", 400)
+        return wrap_text_bytes(name, data)
+
+    async def close(self):
+        """Release the conversion pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def _convert_pdf(self, source: DocumentSource, stem: str) -> str:
         """Convert PDF to markdown using PyMuPDF"""
-        doc = self.fitz.open(str(file_path))
-        text = ""
+        parts = []
+        
+        if isinstance(source, Path):
+            pdf = self.fitz.open(str(source))
+        else:
+            pdf = self.fitz.open(stream=_rewind(source).read(), filetype="pdf")
         
-        for page_num in range(doc.page_count):
-            page = doc[page_num]
-            page_text = page.get_text()
-            if page_text.strip():
-                text += f"\n## Page {page_num + 1}\n\n{page_text}\n"
+        # PyMuPDF documents are not thread-safe, so pages are read sequentially;
+        # the whole conversion already runs in the executor, off the event loop
+        with pdf as doc:
+            for page_num in range(doc.page_count):
+                page_text = doc[page_num].get_text()
+                if page_text.strip():
+                    parts.append(f"\n## Page {page_num + 1}\n\n{page_text}\n")
         
-        doc.close()
+        text = "".join(parts)
         
         if not text.strip():
             raise AppException("No text content found in PDF", 400)
             
-        return f"# {file_path.stem}\n\n{text}"
+        return f"# {stem}\n\n{text}"
 
-    def _convert_docx(self, file_path: Path) -> str:
-        """Convert DOCX to markdown using mammoth"""
-        with open(file_path, "rb") as docx_file:
-            result = self.mammoth.convert_to_markdown(docx_file)
-            
-            if result.messages:
-                for message in result.messages:
-                    logger.warning(f"Mammoth conversion warning: {message}")
+    def _convert_docx(self, source: DocumentSource, stem: str) -> str:
+        """Convert DOCX to markdown, streaming large plain documents and using mammoth otherwise"""
+        markdown_content = self._convert_docx_streaming(source)
+        if markdown_content:
+            return markdown_content
+        
+        if isinstance(source, Path):
+            with open(source, "rb") as docx_file:
+                result = self.mammoth.convert_to_markdown(docx_file)
+        else:
+            result = self.mammoth.convert_to_markdown(_rewind(source))
+        
+        if result.messages:
+            for message in result.messages:
+                logger.warning(f"Mammoth conversion warning: {message}")
+        
+        markdown_content = result.value
+        
+        if not markdown_content.strip():
+            # Fallback to python-docx if mammoth fails
+            return self._convert_docx_fallback(source, stem)
             
-            markdown_content = result.value
+        return markdown_content
+
+    def _convert_docx_streaming(self, source: DocumentSource) -> str:
+        """Stream paragraphs of a large, text-only DOCX straight from its XML.
+        Returns "" when the document is small or contains tables/images, so mammoth handles it."""
+        with zipfile.ZipFile(_rewind(source)) as archive:
+            try:
+                info = archive.getinfo("word/document.xml")
+            except KeyError:
+                return ""
+            if info.file_size < DOCX_STREAMING_MIN_BYTES:
+                return ""
             
-            if not markdown_content.strip():
-                # Fallback to python-docx if mammoth fails
-                return self._convert_docx_fallback(file_path)
-                
-            return markdown_content
+            parts = []
+            with archive.open(info) as document_xml:
+                events = self.etree.iterparse(
+                    document_xml,
+                    events=("start", "end"),
+                    tag=(f"{_W}p", *_DOCX_COMPLEX_TAGS)
+                )
+                for event, elem in events:
+                    if elem.tag in _DOCX_COMPLEX_TAGS:
+                        return ""
+                    if event != "end":
+                        continue
+                    
+                    text = "".join(
+                        node.text or "" if node.tag == f"{_W}t" else "\t" if node.tag == f"{_W}tab" else "\n"
+                        for node in elem.iter(f"{_W}t", f"{_W}tab", f"{_W}br")
+                    )
+                    if text.strip():
+                        style = elem.find(f"{_W}pPr/{_W}pStyle")
+                        heading = _HEADING_STYLE_RE.match(style.get(f"{_W}val", "")) if style is not None else None
+                        if heading:
+                            text = f"{'#' * int(heading.group(1))} {text}"
+                        elif elem.find(f"{_W}pPr/{_W}numPr") is not None:
+                            text = f"- {text}"
+                        parts.append(text)
+                    
+                    # Free parsed paragraphs as we go
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+        
+        return "\n\n".join(parts) + "\n\n" if parts else ""
 
-    def _convert_docx_fallback(self, file_path: Path) -> str:
+    def _convert_docx_fallback(self, source: DocumentSource, stem: str) -> str:
         """Fallback DOCX conversion using python-docx"""
-        doc = self.Document(str(file_path))
-        text = ""
+        doc = self.Document(str(source) if isinstance(source, Path) else _rewind(source))
+        parts = []
         
         for paragraph in doc.paragraphs:
-            if paragraph.text.strip():
-                text += paragraph.text + "\n\n"
+            paragraph_text = paragraph.text
+            if paragraph_text.strip():
+                parts.append(paragraph_text)
+        
+        text = "\n\n".join(parts) + "\n\n" if parts else ""
         
         if not text.strip():
             raise AppException("No text content found in DOCX", 400)
             
-        return f"# {file_path.stem}\n\n{text}"
+        return f"# {stem}\n\n{text}"
 
-    def _convert_doc(self, file_path: Path) -> str:
+    def _convert_doc(self, source: DocumentSource, stem: str) -> str:
         """Convert DOC files - requires python-docx2txt or similar"""
         try:
             import docx2txt
-            text = docx2txt.process(str(file_path))
+            text = docx2txt.process(str(source) if isinstance(source, Path) else _rewind(source))
             
             if not text.strip():
                 raise AppException("No text content found in DOC file", 400)
                 
-            return f"# {file_path.stem}\n\n{text}"
+            return f"# {stem}\n\n{text}"
         except ImportError:
             # Fallback: suggest user to convert DOC to DOCX
             raise AppException("DOC files not supported. Please convert to DOCX format.", 400)
 
-    def _convert_txt(self, file_path: Path) -> str:
+    def _convert_txt(self, source: DocumentSource, stem: str) -> str:
         """Convert TXT to markdown"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except UnicodeDecodeError:
-            # Try with different encoding
-            with open(file_path, 'r', encoding='latin-1') as f:
-                content = f.read()
-        
-        if not content.strip():
-            raise AppException("Text file is empty", 400)
-            
-        return f"# {file_path.stem}\n\n{content}"
\ No newline at end of file
+        data = source.read_bytes() if isinstance(source, Path) else _rewind(source).read()
+        return wrap_text_bytes(stem, data)
\ No newline at end of file
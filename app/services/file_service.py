@@ -1,6 +1,7 @@
-import uuid
+import asyncio
+import hashlib
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List
 import logging
 
 from fastapi import UploadFile
@@ -11,12 +12,30 @@ from app.utils.exceptions import AppException
 
 logger = logging.getLogger(__name__)
 
+def _file_sha256(fileobj) -> str:
+    """SHA-256 of a file object's full contents, leaving it rewound (blocking)"""
+    fileobj.seek(0)
+    digest = hashlib.file_digest(fileobj, "sha256").hexdigest()
+    fileobj.seek(0)
+    return digest
+
 class FileService:
-    def __init__(self):
-        self.document_converter = DocumentConverter()
-        self.db_service = DatabaseService()
-        self.upload_dir = Path(settings.UPLOAD_DIR)
-        self.upload_dir.mkdir(exist_ok=True)
+    def __init__(
+        self,
+        document_converter: DocumentConverter = None,
+        db_service: DatabaseService = None
+    ):
+        # Pass shared instances in to reuse their thread pool / Supabase client
+        self.document_converter = document_converter or DocumentConverter()
+        self.db_service = db_service or DatabaseService()
+        # Caps uploads being converted at once, across single and batch requests
+        self._convert_sem = asyncio.Semaphore(settings.MAX_CONCURRENT_CONVERSIONS)
+        # Caps concurrent upload inserts so bursts don't exhaust Supabase connections
+        self._db_sem = asyncio.Semaphore(settings.MAX_CONCURRENT_DB_WRITES)
+
+    async def close(self):
+        """Release resources held by the document converter"""
+        await self.document_converter.close()
 
     async def process_upload(
         self, 
@@ -27,64 +46,141 @@ class FileService:
         """Process file upload: validate, convert to markdown, save to Supabase"""
         
         # Validate file
-        await self._validate_file(file)
-        
-        # Save file temporarily
-        temp_file_path = await self._save_temp_file(file)
+        file_ext = await self._validate_file(file)
         
         try:
-            # Convert with document converter
-            markdown_content = await self.document_converter.convert_to_markdown(temp_file_path)
-            
-            # Update filename and file type to reflect markdown conversion
-            original_name = Path(file.filename).stem  # Get filename without extension
-            markdown_filename = f"{original_name}.md"
+            converted = await self._convert_upload(file, file_ext, user_id)
             
             # Save to Supabase database
-            file_record = await self.db_service.save_converted_file(
-                filename=markdown_filename,
-                file_type=".md",
-                content=markdown_content,
-                user_id=user_id,
-                workspace_id=workspace_id
-            )
+            async with self._db_sem:
+                file_record = await self.db_service.save_converted_file(
+                    user_id=user_id,
+                    workspace_id=workspace_id,
+                    **converted
+                )
             
-            return {
-                "success": True,
-                "file_id": file_record["id"],
-                "filename": markdown_filename,
-                "message": "File uploaded and converted to markdown successfully"
-            }
+            return self._upload_result(file_record, converted["filename"])
             
         except Exception as e:
             logger.error(f"File processing failed: {str(e)}")
             raise AppException("File processing failed", 500, str(e))
+
+    async def process_uploads(
+        self,
+        files: List[UploadFile],
+        user_id: str,
+        workspace_id: str = None
+    ) -> List[Dict[str, Any]]:
+        """Process several uploads: convert them concurrently, then save them with a single insert.
+        Returns one result per file, in order; a failing file doesn't fail the others."""
+        
+        async def prepare(file: UploadFile) -> Dict[str, str]:
+            file_ext = await self._validate_file(file)
+            return await self._convert_upload(file, file_ext, user_id)
+        
+        converted = await asyncio.gather(*(prepare(file) for file in files), return_exceptions=True)
+        rows = [item for item in converted if not isinstance(item, BaseException)]
+        
+        records = []
+        if rows:
+            try:
+                async with self._db_sem:
+                    records = await self.db_service.save_converted_files_bulk(rows, user_id, workspace_id)
+            except Exception as e:
+                # Fall back to individual inserts so one bad row doesn't fail the whole batch
+                logger.warning(f"Bulk file insert failed, saving files individually: {str(e)}")
+                records = []
+                for row in rows:
+                    try:
+                        async with self._db_sem:
+                            records.append(await self.db_service.save_converted_file(
+                                user_id=user_id,
+                                workspace_id=workspace_id,
+                                **row
+                            ))
+                    except Exception as row_error:
+                        records.append(row_error)
         
+        results = []
+        saved = iter(zip(rows, records))
+        for file, item in zip(files, converted):
+            if not isinstance(item, BaseException):
+                row, item = next(saved)
+            if isinstance(item, BaseException):
+                logger.error(f"File processing failed for {file.filename}: {str(item)}")
+                message = item.message if isinstance(item, AppException) else "File processing failed"
+                results.append({"success": False, "file_id": None, "filename": file.filename, "message": message})
+            else:
+                results.append(self._upload_result(item, row["filename"]))
+        
+        return results
+
+    async def _convert_upload(self, file: UploadFile, file_ext: str, user_id: str) -> Dict[str, str]:
+        """Convert a validated upload to markdown; returns the file row fields to save"""
+        original_name = Path(file.filename).stem  # Get filename without extension
+        markdown_filename = f"{original_name}.md"
+        
+        try:
+            if file_ext == ".txt":
+                data = await file.read()
+                source_hash = hashlib.sha256(data).hexdigest()
+            else:
+                source_hash = await asyncio.to_thread(_file_sha256, file.file)
+            
+            # The same document uploaded again by this user converts to the same markdown, so reuse it.
+            # Keyed on the filename too: the stem is written into the markdown title
+            markdown_content = await self.db_service.find_converted_content(source_hash, markdown_filename, user_id)
+            if markdown_content is not None:
+                logger.info(f"Reusing converted content for {file.filename}")
+            else:
+                async with self._convert_sem:
+                    if file_ext == ".txt":
+                        # Plain text needs no conversion library or worker thread
+                        markdown_content = self.document_converter.convert_bytes_to_markdown(
+                            original_name, data, file_ext
+                        )
+                    else:
+                        # Convert straight from the upload's spooled file; no copy to disk
+                        markdown_content = await self.document_converter.convert_to_markdown_stream(
+                            file.file, file.filename
+                        )
         finally:
-            # Clean up temp file
-            if temp_file_path.exists():
-                temp_file_path.unlink()
+            # Release the spooled upload now rather than after the database round trip.
+            # Its on-disk spill is an anonymous temp file, so closing it is the whole cleanup
+            await file.close()
+        
+        # Update filename and file type to reflect markdown conversion
+        return {
+            "filename": markdown_filename,
+            "file_type": ".md",
+            "content": markdown_content,
+            "source_hash": source_hash
+        }
+
+    def _upload_result(self, file_record: Dict[str, Any], markdown_filename: str) -> Dict[str, Any]:
+        """Response payload for a saved upload"""
+        return {
+            "success": True,
+            "file_id": file_record["id"],
+            "filename": markdown_filename,
+            "message": "File uploaded and converted to markdown successfully"
+        }
 
-    async def _validate_file(self, file: UploadFile):
-        """Validate uploaded file"""
-        if file.size > settings.MAX_FILE_SIZE:
+    async def _validate_file(self, file: UploadFile) -> str:
+        """Validate uploaded file; returns its lower-cased extension"""
+        size = file.size
+        if size is None:
+            # Not every UploadFile records its size; measure the spooled file instead
+            size = await asyncio.to_thread(file.file.seek, 0, 2)
+            await file.seek(0)
+        if size > settings.MAX_FILE_SIZE:
             raise AppException("File too large", 413)
         
         file_ext = Path(file.filename).suffix.lower()
-        if file_ext not in settings.ALLOWED_FILE_TYPES:
+        if file_ext not in settings.ALLOWED_FILE_TYPES_SET:
             raise AppException("File type not supported", 400)
-
-    async def _save_temp_file(self, file: UploadFile) -> Path:
-        """Save uploaded file temporarily"""
-        file_id = str(uuid.uuid4())
-        file_ext = Path(file.filename).suffix
-        temp_path = self.upload_dir / f"{file_id}{file_ext}"
-        
-        with open(temp_path, "wb") as temp_file:
-            content = await file.read()
-            temp_file.write(content)
         
-        return temp_path
+        return file_ext
 
     async def get_user_files(self, user_id: str) -> list:
         """Get all converted files for a user"""
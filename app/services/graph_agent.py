@@ -7,17 +7,31 @@ Now works with Supabase database instead of local files
 
 import os
 import re
-from typing import Dict, List, Any, Optional, TypedDict, Annotated
+import shutil
+import tempfile
+import hashlib
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Any, Optional, Tuple, TypedDict, Annotated
 from dataclasses import dataclass
 from enum import Enum
 import json
+import mmap
 from datetime import datetime
+from pathlib import Path
 
+import httpx
+import orjson
+from cachetools import TTLCache
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolNode
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langchain_groq import ChatGroq
-from langchain.tools import StructuredTool
+from langchain_core.tools import StructuredTool
 from pydantic import BaseModel, Field
 from pinecone import Pinecone
 from dotenv import load_dotenv
@@ -27,6 +41,349 @@ from app.utils.exceptions import AppException
 
 load_dotenv()
 
+# Per-namespace Pinecone searches run concurrently, up to this many at a time
+SEARCH_CONCURRENCY = 8
+
+# How long a missing ./temp/ is remembered before _get_namespaces checks again
+NAMESPACE_RETRY_SECONDS = 5
+
+# Characters of each chunk shown to the LLM when filtering search results
+FILTER_PREVIEW_CHARS = 300
+
+# LLM answers for repeated queries: intent keyed by (query hash, has context file),
+# relevance filtering keyed by (query, hit ids)
+LLM_CACHE_TTL = 300  # seconds
+_intent_cache: TTLCache = TTLCache(maxsize=2048, ttl=LLM_CACHE_TTL)
+_filter_cache: TTLCache = TTLCache(maxsize=1024, ttl=LLM_CACHE_TTL)
+_llm_cache_lock = threading.Lock()
+
+# Document analysis answers keyed by (analysis type, normalized query, filename, content hash).
+# Queries about the present moment are not cached.
+ANALYSIS_CACHE_TTL = 3600  # seconds
+_analysis_cache: TTLCache = TTLCache(maxsize=512, ttl=ANALYSIS_CACHE_TTL)
+_VOLATILE_QUERY_RE = re.compile(r'\b(?:now|today|tomorrow|yesterday|current(?:ly)?|latest)\b', re.IGNORECASE)
+
+# Documents longer than ANALYSIS_MAX_CHARS are analyzed from section summaries instead of in full.
+# The document gets what is left of the analysis model's context (llama3-70b-8192) after the
+# instructions, the task and room for the reply. Sizes are in characters, at ~4 per token.
+ANALYSIS_CONTEXT_TOKENS = 8192
+ANALYSIS_PROMPT_TOKENS = 1024  # system prompt and task
+ANALYSIS_REPLY_TOKENS = 2048
+ANALYSIS_MAX_CHARS = (ANALYSIS_CONTEXT_TOKENS - ANALYSIS_PROMPT_TOKENS - ANALYSIS_REPLY_TOKENS) * 4  # 20480
+SUMMARY_SECTION_CHARS = 16_000
+# Section summaries keyed by the section's content hash
+_summary_cache: TTLCache = TTLCache(maxsize=1024, ttl=ANALYSIS_CACHE_TTL)
+
+# Queries whose opening words leave no doubt about the intent are routed without the LLM.
+# Question forms mean ANALYZE with a context file and SEARCH without one, as in the LLM prompt.
+# Only read-only intents are routed locally: an EDIT rewrites the context file, so a query
+# opening with an edit verb ("update me on progress" is not an edit) always goes to the LLM.
+_LOCAL_INTENT_RULES = [
+    ("EDIT", re.compile(r'^(?:please\s+)?(?:add|insert|append|update|change|modify|edit|replace|rewrite|remove|delete)\b', re.IGNORECASE)),
+    ("SEARCH", re.compile(r'^(?:please\s+)?(?:search|find(?!\s+and\s+replace)|look\s+(?:for|up))\b|^(?:which|what)\s+(?:document|file)s?\b', re.IGNORECASE)),
+    ("VIEW", re.compile(r'^(?:please\s+)?(?:show|display|view|open)\s+(?:me\s+)?(?:the\s+)?(?:lines?|file|raw|content)\b', re.IGNORECASE)),
+    ("QUESTION", re.compile(r'^(?:please\s+)?(?:summari[sz]e|explain|tell\s+me\s+about|what\s+(?:is|are)|describe)\b', re.IGNORECASE)),
+]
+
+def _classify_intent_locally(query: str, has_context: bool) -> Optional[str]:
+    """Intent word for unambiguous queries, or None to ask the LLM"""
+    matches = [intent for intent, pattern in _LOCAL_INTENT_RULES if pattern.search(query.strip())]
+    if len(matches) != 1 or matches[0] == "EDIT":
+        return None
+    if matches[0] == "QUESTION":
+        return "ANALYZE" if has_context else "SEARCH"
+    return matches[0]
+
+# Keyword tables for _analyze_edit_request, each scanned in one regex pass. Keywords match
+# at a word start, so inflections ("changes", "inserting") still count. When several match,
+# the one listed first in the table wins.
+_EDIT_TYPE_KEYWORDS = {
+    "add": "add", "adding": "add", "insert": "add",
+    "replace": "replace", "change": "replace",
+    "update": "modify", "modify": "modify", "edit": "modify",
+}
+_EDIT_TYPE_RE = re.compile(r'\b(' + '|'.join(sorted(_EDIT_TYPE_KEYWORDS, key=len, reverse=True)) + ')', re.IGNORECASE)
+_EDIT_TYPE_PRIORITY = ("add", "replace", "modify")
+
+_SECTION_KEYWORDS = {
+    "core section": "core system",
+    "introduction": "introduction",
+    "experience": "experience",
+}
+_SECTION_RE = re.compile('|'.join(_SECTION_KEYWORDS), re.IGNORECASE)
+_SECTION_PRIORITY = tuple(_SECTION_KEYWORDS)
+
+# "Which document ..." questions, answered from the search hits' file names
+_DOCUMENT_QUESTION_RE = re.compile(r'\b(?:which|what) (?:document|file)', re.IGNORECASE)
+
+# Prompt templates, filled in with str.format
+_FILTER_PROMPT = """
+Decide which search results are ACTUALLY relevant to the query.
+Be strict - only include results that directly relate to what the user is asking about.
+
+Respond with JSON only: {{"relevant": [result numbers]}}, e.g. {{"relevant": [3, 4]}}.
+If no results are relevant, respond {{"relevant": []}}
+
+QUERY: "{query}"
+
+{results_text}"""
+
+_INTENT_PROMPT = """
+Analyze this user query and determine their intent.
+
+Guidelines:
+- EDIT: User wants to modify, change, update, add to, or alter content
+- SEARCH: User wants to find or look for information across multiple documents OR when no context file is provided
+- VIEW: User wants to see raw file content or display specific sections
+- ANALYZE: User asks questions about document content, wants explanations, summaries, or specific information from the document (like "what is the timeline", "tell me about", "explain", etc.)
+- CHAT: General conversation or unclear intent
+
+Important: If there's a context file and the user is asking a question about the document content (like "what is...", "tell me about...", "explain..."), choose ANALYZE, not SEARCH or VIEW.
+
+Respond with ONLY ONE WORD: EDIT, SEARCH, VIEW, ANALYZE, or CHAT
+
+CONTEXT FILE: {context_file}
+USER QUERY: "{query}"
+"""
+
+_EDIT_PROMPT = """
+You are a smart document editor. The user wants to edit the document below.
+
+Your task:
+1. Understand what the user wants to edit/add/modify
+2. Find the relevant lines in the document
+3. Describe the change as line edits, preserving the document structure
+
+Respond with JSON only, in this form:
+{{"edits": [{{"start_line": 12, "end_line": 14, "new_text": "replacement for lines 12-14"}}]}}
+
+Important:
+- Each edit replaces lines start_line..end_line (inclusive) with new_text, without line number prefixes
+- To insert without replacing, use end_line = start_line - 1 (the text goes before start_line)
+- To delete lines, use an empty new_text
+- Do not repeat unchanged lines, and do not let edits overlap
+- Maintain the same formatting and structure
+
+DOCUMENT: {filename}
+CURRENT CONTENT (each line prefixed with its line number):
+{numbered_content}
+
+USER REQUEST: "{edit_request}"
+"""
+
+_REWRITE_PROMPT = """
+Rewrite a document section according to an edit instruction.
+
+Instructions:
+- If edit_type is "add": Add the new content to the existing content (usually at the end)
+- If edit_type is "replace": Replace specific parts while keeping the structure
+- If edit_type is "modify": Modify the content while preserving the overall structure
+- If edit_type is "insert": Insert new content at appropriate location
+
+Provide ONLY the new section content. Keep the same formatting style and structure.
+Do not include explanations or markdown code blocks.
+
+Edit type: {edit_type}
+Edit instruction: {edit_instruction}
+
+Current section content:
+{section_content}
+"""
+
+_SUMMARY_PROMPT = """
+Summarize this section of a longer document. Keep every fact a reader might ask about:
+names, numbers, dates, requirements, decisions and section headings.
+Write plain prose or bullet points, at most a fifth of the original length. No introduction.
+
+SECTION {index} OF {total}:
+{section}
+"""
+
+def _split_sections(content: str, size: int) -> List[str]:
+    """Split a document into pieces of about `size` characters at line boundaries"""
+    sections, current, current_len = [], [], 0
+    for line in content.splitlines(keepends=True):
+        if current and current_len + len(line) > size:
+            sections.append("".join(current))
+            current, current_len = [], 0
+        current.append(line)
+        current_len += len(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+def _analysis_prefix(content: str, filename: str) -> Tuple[List[BaseMessage], str]:
+    """Shared leading messages of every analysis prompt for a document, and the content's hash.
+    Instructions, then the document, then the task: questions about the same document share
+    the whole prefix, which the provider can serve from its prompt cache"""
+    content_hash = hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+    prefix = [
+        SystemMessage(content=_ANALYSIS_SYSTEM_PROMPT),
+        HumanMessage(content=f"DOCUMENT: {filename}\nCONTENT:\n{content}")
+    ]
+    return prefix, content_hash
+
+def _analysis_task(query: str) -> str:
+    """Task message for a question: a fixed variant if one matches, otherwise general analysis"""
+    matched = {_ANALYSIS_TASK_PHRASES[phrase.lower()] for phrase in _ANALYSIS_TASK_RE.findall(query)}
+    return next((t for t in _ANALYSIS_TASK_PRIORITY if t in matched), None) or _QUESTION_TASK.format(query=query)
+
+def _analysis_cache_key(query: str, analysis_type: str, filename: str, content_hash: str) -> Optional[tuple]:
+    """Cache key of an analysis answer; None for time-sensitive questions"""
+    if _VOLATILE_QUERY_RE.search(query):
+        return None
+    return (analysis_type, " ".join(query.lower().split()), filename, content_hash)
+
+def _prompt_cache_usage(response) -> Tuple[int, int]:
+    """(cached, total) prompt tokens of an LLM response, from LangChain's usage metadata
+    or, when that lacks cache details, the provider's raw token usage"""
+    usage = getattr(response, "usage_metadata", None) or {}
+    cached = usage.get("input_token_details", {}).get("cache_read")
+    total = usage.get("input_tokens")
+    if cached is None:
+        token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+        cached = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+        total = total or token_usage.get("prompt_tokens")
+    return cached or 0, total or 0
+
+def _apply_line_edits(lines: List[str], edits: List[Dict[str, Any]]) -> List[str]:
+    """Apply {start_line, end_line, new_text} edits (1-based, inclusive) to a document's lines"""
+    ranges = []
+    for edit in edits:
+        start = int(edit["start_line"])
+        end = int(edit.get("end_line", start))
+        if not (1 <= start <= len(lines) + 1 and start - 1 <= end <= len(lines)):
+            raise ValueError(f"line range {start}-{end} is outside the document")
+        new_text = edit.get("new_text") or ""
+        if new_text and not new_text.endswith('\n'):
+            new_text += '\n'
+        ranges.append((start, end, new_text))
+    
+    ranges.sort()
+    for (_, prev_end, _), (start, _, _) in zip(ranges, ranges[1:]):
+        if start <= prev_end:
+            raise ValueError("edits overlap")
+    
+    # Apply from the bottom up so earlier line numbers stay valid
+    lines = list(lines)
+    # A last line without a newline is only touched when an edit reaches the end of the file;
+    # then it is terminated for the edit and the missing final newline restored afterwards
+    open_end = bool(lines and ranges) and not lines[-1].endswith('\n') and ranges[-1][1] == len(lines)
+    if open_end:
+        lines[-1] += '\n'
+    for start, end, new_text in reversed(ranges):
+        lines[start - 1:end] = new_text.splitlines(keepends=True)
+    if open_end and lines:
+        lines[-1] = lines[-1][:-1]
+    return lines
+
+# Document analysis: the instructions are the same for every question, so they lead the prompt
+_ANALYSIS_SYSTEM_PROMPT = """
+You analyze documents for the user. The document comes first, followed by the task.
+Base your answer on the document content only.
+"""
+
+_OVERVIEW_TASK = """
+Analyze this document and provide a comprehensive overview.
+
+Provide a clear, structured analysis including:
+1. **Document Purpose**: What is this document about?
+2. **Key Sections**: What are the main sections/topics covered?
+3. **Important Details**: Key information, requirements, or proposals
+4. **Summary**: Brief overview of the main points
+
+Be concise but informative.
+"""
+
+_CORE_SYSTEM_TASK = """
+Analyze this document and focus specifically on the core system information.
+
+Focus on:
+1. **Core System Components**: What are the main technical components?
+2. **Architecture**: How is the system structured?
+3. **Key Features**: What are the primary capabilities?
+4. **Technical Details**: Important technical specifications
+
+Provide a focused answer about the core system.
+"""
+
+_QUESTION_TASK = """
+Answer the user's question about this document: "{query}"
+
+Provide a direct, helpful answer to their specific question based on the document content.
+If the question can't be answered from the document, say so clearly.
+"""
+
+# Fixed task variants for _analyze_document_content, picked in one regex pass over the query;
+# the overview wins when both match. Anything else becomes a _QUESTION_TASK.
+_ANALYSIS_TASK_PHRASES = {
+    "tell me about this": _OVERVIEW_TASK,
+    "this document": _OVERVIEW_TASK,
+    "core system": _CORE_SYSTEM_TASK,
+}
+_ANALYSIS_TASK_RE = re.compile('|'.join(map(re.escape, _ANALYSIS_TASK_PHRASES)), re.IGNORECASE)
+_ANALYSIS_TASK_PRIORITY = (_OVERVIEW_TASK, _CORE_SYSTEM_TASK)
+
+# Decoded documents keyed by (path, mtime_ns, size), so an unchanged file is read and decoded once
+_document_cache: TTLCache = TTLCache(maxsize=64, ttl=ANALYSIS_CACHE_TTL)
+
+def _read_document(path: str) -> str:
+    """Read a UTF-8 document as text, with universal newlines like open(path, 'r')"""
+    st = os.stat(path)
+    cache_key = (path, st.st_mtime_ns, st.st_size)
+    with _llm_cache_lock:
+        text = _document_cache.get(cache_key)
+    if text is not None:
+        return text
+    
+    if st.st_size == 0:
+        text = ""
+    else:
+        # Decode straight from the mapped page cache, without copying the file into a bytes object first
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            text = str(mm, 'utf-8')
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+    
+    with _llm_cache_lock:
+        _document_cache[cache_key] = text
+    return text
+
+# The agent only reads and edits documents inside its base directories: no dotfiles (.env),
+# no source or config files, nothing reached through absolute or ".." paths
+DOCUMENT_EXTENSIONS = (".md", ".markdown", ".txt")
+
+# Agent file index saved between process starts
+FILE_INDEX_CACHE_PATH = Path.home() / ".docpilot" / "file_index.json"
+
+# Buffer size for the agent's line-by-line file I/O; the 8 KiB default means many small syscalls
+FILE_BUFFER_SIZE = 128 * 1024
+
+def _backup_file(path: str) -> str:
+    """Keep the current version of a file next to it before an edit; returns the backup path"""
+    backup_path = f"{path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    try:
+        # The edit replaces the file rather than rewriting it, so a hard link keeps the old content
+        os.link(path, backup_path)
+    except OSError:
+        shutil.copy2(path, backup_path)
+    return backup_path
+
+def _write_atomic(path: str, content: str):
+    """Replace a file's content in one step; readers never see a partial write"""
+    with tempfile.NamedTemporaryFile(
+        'w', buffering=FILE_BUFFER_SIZE, dir=os.path.dirname(path) or '.', delete=False, encoding='utf-8', suffix='.tmp'
+    ) as tmp:
+        tmp.write(content)
+    try:
+        shutil.copymode(path, tmp.name)
+        os.replace(tmp.name, path)
+    except OSError:
+        os.unlink(tmp.name)
+        raise
+
 class QueryType(Enum):
     SEARCH = "search"
     EDIT = "edit" 
@@ -53,13 +410,34 @@ class AgentState(TypedDict):
 
 class SmartGraphAgent:
     def __init__(self):
+        # One keep-alive connection pool for both Groq clients, so calls reuse open TLS connections
+        self._groq_http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=32)
+        )
+        
         # Initialize LLM
         self.llm = ChatGroq(
             groq_api_key=os.getenv("GROQ_API_KEY"),
             model="llama3-70b-8192",
-            temperature=0.3  # Lower for more consistent analysis
+            temperature=0.3,  # Lower for more consistent analysis
+            http_client=self._groq_http_client
+        )
+        
+        # Small, fast model for the one-word intent and relevance classification calls;
+        # the 70B model is kept for editing and document analysis
+        self.llm_small = ChatGroq(
+            groq_api_key=os.getenv("GROQ_API_KEY"),
+            model="llama-3.1-8b-instant",
+            temperature=0.1,
+            http_client=self._groq_http_client
         )
         
+        # Whole-document edits come back as JSON line edits
+        self._edit_llm = self.llm.bind(response_format={"type": "json_object"})
+        
+        # Relevance filtering answers with a short JSON object
+        self._filter_llm = self.llm_small.bind(response_format={"type": "json_object"}, max_tokens=64)
+        
         # Initialize Pinecone
         try:
             self.pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
@@ -69,10 +447,20 @@ class SmartGraphAgent:
             self.pc = None
             self.index = None
         
+        # Shared by all searches; the namespace queries are network-bound
+        self._search_pool = ThreadPoolExecutor(max_workers=SEARCH_CONCURRENCY, thread_name_prefix="agent-search")
+        
+        # Namespaces derived from ./temp/, rebuilt when the directory's mtime changes
+        self._ns_cache = None
+        self._ns_mtime = -1
+        self._ns_retry_at = 0.0
+        
+        # Last backup per file: path -> (content hash, backup path)
+        self._last_backup = {}
+        
         # File management
-        self.base_directories = ["./temp/", "./documents/", "./data/", "./files/", os.getcwd()]
-        self.file_index = {}
-        self._build_file_index()
+        self.base_directories = ["./temp/", "./documents/", "./data/", "./files/"]
+        self._load_file_index()
         
         # Create tools
         self.tools = self._create_tools()
@@ -80,16 +468,96 @@ class SmartGraphAgent:
         # Build the graph
         self.graph = self._build_graph()
     
+    def _load_file_index(self):
+        """Load the file index from its disk cache; walk the directories only when they changed"""
+        try:
+            cached = orjson.loads(FILE_INDEX_CACHE_PATH.read_bytes())
+            index, dir_mtimes, roots = cached["index"], cached["dirs"], cached["roots"]
+            if not (isinstance(index, dict) and isinstance(dir_mtimes, dict) and isinstance(roots, list)):
+                raise ValueError("malformed file index cache")
+        except Exception:
+            self._build_file_index()
+            return
+        
+        self._set_file_index({str(name): str(path) for name, path in index.items()}, fresh=False)
+        if roots == list(self._index_roots().values()) and self._dirs_unchanged(dir_mtimes):
+            # Every directory is as it was when the index was built, so no file has gone since
+            self._file_index_fresh = True
+            print(f"📁 Loaded {len(self.file_index)} indexed files from cache")
+        else:
+            # Serve the previous index while the directories are walked again
+            threading.Thread(target=self._build_file_index, name="agent-file-index", daemon=True).start()
+    
+    @staticmethod
+    def _dirs_unchanged(dir_mtimes: Dict[str, int]) -> bool:
+        """Whether every directory the index was built from still has its recorded mtime.
+        Adding, removing or renaming an entry changes the mtime of the directory holding it."""
+        try:
+            return all(os.stat(path).st_mtime_ns == mtime for path, mtime in dir_mtimes.items())
+        except OSError:
+            return False
+    
+    def _index_roots(self) -> Dict[str, str]:
+        """Base directories to walk, by real path: skip repeated base dirs and ones nested in another"""
+        roots = {}
+        for base_dir in self.base_directories:
+            real_dir = os.path.realpath(base_dir)
+            if os.path.isdir(real_dir) and real_dir not in roots:
+                roots[real_dir] = base_dir
+        return {
+            real_dir: base_dir for real_dir, base_dir in roots.items()
+            if not any(real_dir.startswith(other + os.sep) for other in roots)
+        }
+    
     def _build_file_index(self):
         """Build index of available files"""
-        self.file_index = {}
-        for base_dir in self.base_directories:
-            if os.path.exists(base_dir):
-                for root, dirs, files in os.walk(base_dir):
-                    for file in files:
-                        full_path = os.path.join(root, file)
-                        self.file_index[file] = full_path
+        file_index = {}
+        dir_mtimes = {}
+        
+        # Walk each directory tree once
+        roots = self._index_roots()
+        for base_dir in roots.values():
+            stack = [base_dir]
+            while stack:
+                path = stack.pop()
+                try:
+                    # Stat before listing, so a change made during the walk invalidates the cache
+                    dir_mtimes[path] = os.stat(path).st_mtime_ns
+                    entries = os.scandir(path)
+                except OSError:
+                    continue
+                with entries:
+                    for entry in entries:
+                        if entry.name.startswith('.'):
+                            continue
+                        # Like os.walk, don't descend into symlinked directories
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                stack.append(entry.path)
+                        elif entry.name.lower().endswith(DOCUMENT_EXTENSIONS):
+                            file_index[entry.name] = entry.path
+        
+        self._set_file_index(file_index)
         print(f"📁 Indexed {len(self.file_index)} files")
+        
+        try:
+            FILE_INDEX_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = FILE_INDEX_CACHE_PATH.with_suffix('.tmp')
+            tmp_path.write_bytes(orjson.dumps({"roots": list(roots.values()), "dirs": dir_mtimes, "index": file_index}))
+            os.replace(tmp_path, FILE_INDEX_CACHE_PATH)
+        except (OSError, TypeError) as e:
+            # TypeError: orjson rejects file names that are not valid UTF-8
+            print(f"⚠️ Could not save file index cache: {e}")
+    
+    def _set_file_index(self, file_index: Dict[str, str], fresh: bool = True):
+        self.file_index = file_index
+        # False for an index read from the disk cache, which may list files deleted since
+        self._file_index_fresh = fresh
+        # Lower-cased names, built once for case-insensitive lookups in _resolve_filepath
+        self._file_index_items_lower = [(name.lower(), path) for name, path in file_index.items()]
+        self._file_index_lower = dict(self._file_index_items_lower)
+        # Partial-match lookups, which only change when the index does
+        self._partial_match_cache: TTLCache = TTLCache(maxsize=256, ttl=LLM_CACHE_TTL)
     
     def _create_tools(self) -> List[StructuredTool]:
         """Create minimal, focused tools"""
@@ -141,46 +609,67 @@ class SmartGraphAgent:
             if not namespaces:
                 return "📄 No documents indexed"
             
-            all_results = []
-            for ns in namespaces:
-                try:
-                    results = self.index.search(
-                        namespace=ns,
-                        query={"inputs": {"text": query}, "top_k": max(1, top_k // len(namespaces))},
-                        fields=["chunk_text", "filename", "start_line", "end_line", "section_path"]
-                    )
-                    hits = results.get("result", {}).get("hits", [])
-                    for hit in hits:
-                        hit["namespace"] = ns
-                    all_results.extend(hits)
-                except Exception as e:
-                    continue
-            
-            all_results.sort(key=lambda x: x.get("score", 0), reverse=True)
-            return self._format_search_results(all_results[:top_k], query)
+            return self._format_search_results(self._search_hits(query, namespaces, top_k), query)
             
         except Exception as e:
             return f"❌ Search error: {str(e)}"
     
+    def _search_hits(self, query: str, namespaces: List[str], top_k: int = 5) -> List[Dict]:
+        """Top hits across the given namespaces, best first"""
+        per_namespace_k = max(1, top_k // len(namespaces))
+        futures = {
+            self._search_pool.submit(
+                self.index.search,
+                namespace=ns,
+                query={"inputs": {"text": query}, "top_k": per_namespace_k},
+                fields=["chunk_text", "filename", "start_line", "end_line", "section_path"]
+            ): ns
+            for ns in namespaces
+        }
+        
+        all_results = []
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+                hits = results.get("result", {}).get("hits", [])
+                for hit in hits:
+                    hit["namespace"] = futures[future]
+                all_results.extend(hits)
+            except Exception as e:
+                continue
+        
+        # The same chunk can come back from several namespaces; keep its best-scoring copy
+        unique_hits = {}
+        for hit in all_results:
+            fields = hit.get("fields", {})
+            key = (fields.get("filename"), fields.get("start_line"), fields.get("end_line"))
+            if key not in unique_hits or hit.get("score", 0) > unique_hits[key].get("score", 0):
+                unique_hits[key] = hit
+        
+        # Partial selection of the best top_k rather than sorting every hit
+        return heapq.nlargest(top_k, unique_hits.values(), key=lambda x: x.get("score", 0))
+    
     def _view_tool(self, filepath: str, start_line: int = None, end_line: int = None) -> str:
         """View file content tool"""
         try:
-            resolved_path = self._resolve_filepath(filepath)
-            if not os.path.exists(resolved_path):
+            resolved_path, exists = self._resolve_filepath(filepath)
+            if not exists:
                 return f"❌ File not found: {filepath}"
             
-            with open(resolved_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            if start_line is None and end_line is None:
-                # Show file overview
-                total_lines = len(lines)
-                preview = ''.join(lines[:20])
-                return f"📄 **{resolved_path}** ({total_lines} lines)\n```\n{preview}\n```"
+            # Stream the file: only the preview or the requested lines are kept
+            with open(resolved_path, 'r', encoding='utf-8', buffering=FILE_BUFFER_SIZE) as f:
+                if start_line is None and end_line is None:
+                    # Show file overview
+                    preview_lines = list(itertools.islice(f, 20))
+                    total_lines = len(preview_lines) + sum(1 for _ in f)
+                    preview = ''.join(preview_lines)
+                    return f"📄 **{resolved_path}** ({total_lines} lines)\n```\n{preview}\n```"
+                
+                start_idx = max(0, (start_line or 1) - 1)
+                section = list(itertools.islice(f, start_idx, end_line))
             
-            start_idx = max(0, (start_line or 1) - 1)
-            end_idx = min(len(lines), end_line or len(lines))
-            content = ''.join(lines[start_idx:end_idx])
+            end_idx = start_idx + len(section)
+            content = ''.join(section)
             
             return f"📄 **{resolved_path}** (lines {start_idx+1}-{end_idx})\n```\n{content}\n```"
             
@@ -190,12 +679,12 @@ class SmartGraphAgent:
     def _edit_tool(self, filepath: str, start_line: int, end_line: int, new_content: str) -> str:
         """Smart section-based editing tool"""
         try:
-            resolved_path = self._resolve_filepath(filepath)
-            if not os.path.exists(resolved_path):
+            resolved_path, exists = self._resolve_filepath(filepath)
+            if not exists:
                 return f"❌ File not found: {filepath}"
             
             # Read entire file
-            with open(resolved_path, 'r', encoding='utf-8') as f:
+            with open(resolved_path, 'r', encoding='utf-8', buffering=FILE_BUFFER_SIZE) as f:
                 lines = f.readlines()
             
             # Validate line range
@@ -206,9 +695,7 @@ class SmartGraphAgent:
                 return f"❌ Invalid line range: {start_line}-{end_line}"
             
             # Create backup
-            backup_path = f"{resolved_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                f.writelines(lines)
+            backup_path = self._backup(resolved_path, ''.join(lines))
             
             # Ensure new content ends with newline
             if not new_content.endswith('\n'):
@@ -218,115 +705,127 @@ class SmartGraphAgent:
             lines[start_idx:end_idx] = [new_content]
             
             # Write back
-            with open(resolved_path, 'w', encoding='utf-8') as f:
-                f.writelines(lines)
-            
-            # Notify clients about file change via WebSocket
-            try:
-                filename = os.path.basename(resolved_path)
-                tracker = get_content_tracker(os.path.dirname(resolved_path))
-                diff_result = tracker.get_diff(filename)
-                has_changes = diff_result.has_changes if diff_result else True
-                changes_count = diff_result.changes_count if diff_result else 1
-                
-                # Use asyncio to run the async broadcast
-                import asyncio
-                try:
-                    loop = asyncio.get_event_loop()
-                    loop.create_task(manager.broadcast({
-                        "type": "file_changed",
-                        "filename": filename,
-                        "has_changes": has_changes,
-                        "changes": changes_count,
-                        "timestamp": datetime.now().isoformat()
-                    }))
-                except RuntimeError:
-                    # If no event loop is running, create a new one
-                    asyncio.run(manager.broadcast({
-                        "type": "file_changed",
-                        "filename": filename,
-                        "has_changes": has_changes,
-                        "changes": changes_count,
-                        "timestamp": datetime.now().isoformat()
-                    }))
-            except Exception as ws_error:
-                print(f"⚠️ WebSocket notification failed: {ws_error}")
+            _write_atomic(resolved_path, ''.join(lines))
             
             return f"✅ **Edit completed**\n**File:** {resolved_path}\n**Lines:** {start_line}-{end_line}\n**Backup:** {backup_path}"
             
         except Exception as e:
             return f"❌ Edit error: {str(e)}"
     
-    def _resolve_filepath(self, filepath: str) -> str:
-        """Resolve file path from name or path"""
-        if os.path.exists(filepath):
-            return filepath
+    def _backup(self, resolved_path: str, content: str) -> str:
+        """Back up a file before editing it, reusing the last backup if the content is unchanged since"""
+        content_hash = hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+        last_hash, last_backup_path = self._last_backup.get(resolved_path, (None, None))
+        if content_hash == last_hash and os.path.exists(last_backup_path):
+            return last_backup_path
         
-        if filepath in self.file_index:
-            return self.file_index[filepath]
+        backup_path = _backup_file(resolved_path)
+        self._last_backup[resolved_path] = (content_hash, backup_path)
+        return backup_path
+    
+    def _resolve_filepath(self, filepath: str) -> Tuple[str, bool]:
+        """Resolve file path from name or path; also returns whether it exists.
+        Only documents inside the base directories resolve (see DOCUMENT_EXTENSIONS)."""
+        if not filepath or os.path.isabs(filepath) or ".." in Path(filepath).parts:
+            return filepath, False
+        
+        path = self._lookup_filepath(filepath)
+        if path and self._is_servable(path):
+            return path, True
+        return filepath, False
+    
+    def _is_servable(self, path: str) -> bool:
+        """Whether a path is a document inside one of the base directories, after resolving symlinks"""
+        real_path = os.path.realpath(path)
+        if not real_path.lower().endswith(DOCUMENT_EXTENSIONS):
+            return False
+        for root in self._index_roots():
+            if real_path.startswith(root + os.sep):
+                relative = os.path.relpath(real_path, root)
+                return not any(part.startswith('.') for part in relative.split(os.sep))
+        return False
+    
+    def _lookup_filepath(self, filepath: str) -> Optional[str]:
+        """Path for a relative path or (partial) file name, or None.
+        Files in a freshly built index were on disk moments ago, so they are not stat'ed again;
+        an index loaded from the disk cache is checked until its rebuild replaces it."""
+        if os.path.isfile(filepath):
+            return filepath
         
-        # Search for partial matches
-        for filename, path in self.file_index.items():
-            if filepath.lower() in filename.lower():
-                return path
+        filepath_lower = filepath.lower()
+        path = self.file_index.get(filepath) or self._file_index_lower.get(filepath_lower)
+        if path is None:
+            # Search for partial matches
+            with _llm_cache_lock:
+                path = self._partial_match_cache.get(filepath_lower)
+            if path is None:
+                path = next((path for filename_lower, path in self._file_index_items_lower if filepath_lower in filename_lower), "")
+                with _llm_cache_lock:
+                    self._partial_match_cache[filepath_lower] = path
         
-        return filepath
+        if path and not self._file_index_fresh and not os.path.isfile(path):
+            return None
+        return path or None
     
     def _get_namespaces(self) -> List[str]:
         """Get available document namespaces"""
-        namespaces = []
         temp_folder = "./temp/"
-        if os.path.exists(temp_folder):
-            for filename in os.listdir(temp_folder):
-                if filename.lower().endswith(('.md', '.markdown')):
-                    namespace = os.path.splitext(filename)[0].lower().replace(' ', '_').replace('-', '_')
-                    namespaces.append(namespace)
-        return namespaces
+        if time.monotonic() < self._ns_retry_at:
+            return []
+        
+        try:
+            mtime = os.stat(temp_folder).st_mtime_ns
+            if mtime == self._ns_mtime and self._ns_cache is not None:
+                return self._ns_cache
+            
+            self._ns_cache = [
+                os.path.splitext(filename)[0].lower().replace(' ', '_').replace('-', '_')
+                for filename in os.listdir(temp_folder)
+                if filename.lower().endswith(('.md', '.markdown'))
+            ]
+            self._ns_mtime = mtime
+            return self._ns_cache
+        except OSError:
+            self._ns_cache = None
+            self._ns_retry_at = time.monotonic() + NAMESPACE_RETRY_SECONDS
+            return []
     
     def _filter_search_results(self, hits: List[Dict], query: str) -> List[Dict]:
         """Use LLM to filter search results for relevance"""
         if not hits:
             return hits
         
-        # Prepare results for LLM evaluation
+        cache_key = (query, tuple(hit.get("_id") for hit in hits))
+        with _llm_cache_lock:
+            kept = _filter_cache.get(cache_key)
+        if kept is not None:
+            return [hits[i] for i in kept]
+        
+        # Prepare results for LLM evaluation; a preview of each chunk is enough to judge relevance
         results_text = ""
         for i, hit in enumerate(hits):
             fields = hit.get("fields", {})
             filename = fields.get("filename", "unknown")
-            content = fields.get("chunk_text", "").strip()
-            results_text += f"Result {i+1}: {filename}\nContent: {content}\n\n"
+            preview = fields.get("chunk_text", "").strip()[:FILTER_PREVIEW_CHARS]
+            results_text += f"{i+1}. {filename}: {preview}\n"
         
-        filter_prompt = f"""
-Analyze these search results for the query: "{query}"
-
-{results_text}
-
-Return ONLY the numbers (1, 2, 3, etc.) of results that are ACTUALLY relevant to the query "{query}".
-Be strict - only include results that directly relate to what the user is asking about.
-
-Format: Just the numbers separated by commas (e.g., "3, 4" or "2")
-If no results are relevant, return "none"
-"""
+        filter_prompt = _FILTER_PROMPT.format(query=query, results_text=results_text)
         
         try:
-            response = self.llm.invoke([SystemMessage(content=filter_prompt)])
-            relevant_indices = response.content.strip().lower()
+            response = self._filter_llm.invoke([SystemMessage(content=filter_prompt)])
             
-            if relevant_indices == "none":
-                return []
+            try:
+                relevant = json.loads(response.content)["relevant"]
+                indices = [int(n) - 1 for n in relevant if 0 < int(n) <= len(hits)]  # Convert to 0-based
+            except (ValueError, TypeError, KeyError):
+                # Keep everything if the answer could not be parsed
+                indices = list(range(len(hits)))
             
-            # Parse the indices
-            indices = []
-            for idx_str in relevant_indices.split(','):
-                try:
-                    idx = int(idx_str.strip()) - 1  # Convert to 0-based
-                    if 0 <= idx < len(hits):
-                        indices.append(idx)
-                except ValueError:
-                    continue
+            with _llm_cache_lock:
+                _filter_cache[cache_key] = tuple(indices)
             
             # Return filtered results
-            return [hits[i] for i in indices] if indices else hits
+            return [hits[i] for i in indices]
             
         except Exception as e:
             print(f"⚠️ Result filtering failed: {e}")
@@ -334,26 +833,29 @@ If no results are relevant, return "none"
     
     def _answer_document_question(self, search_terms: str, original_query: str) -> str:
         """Answer 'which document' questions directly"""
-        # First get search results
-        search_result = self._search_tool(search_terms)
+        namespaces = self._get_namespaces() if self.index else []
+        if not namespaces:
+            # Let the search tool explain why there is nothing to search
+            return self._search_tool(search_terms)
         
-        # Extract document names from filtered results
-        if "No relevant results found" in search_result or "No results for" in search_result:
+        try:
+            hits = self._search_hits(search_terms, namespaces)
+        except Exception as e:
+            return f"❌ Search error: {str(e)}"
+        
+        relevant_hits = self._filter_search_results(hits, search_terms)
+        if not relevant_hits:
             return f"📄 **Answer:** No documents found that discuss '{search_terms}'"
         
-        # Parse the search results to extract unique document names
-        lines = search_result.split('\n')
-        documents = set()
+        search_result = self._format_search_results(hits, search_terms, relevant_hits)
         
-        for line in lines:
-            if '.md' in line and 'lines' in line:
-                # Extract filename from lines like "**1.** filename.md (lines 1-5)"
-                match = re.search(r'\*\*\d+\.\*\* (.+?\.md)', line)
-                if match:
-                    documents.add(match.group(1))
+        # Unique document names, in relevance order
+        doc_list = list(dict.fromkeys(
+            hit.get("fields", {}).get("filename") for hit in relevant_hits
+            if hit.get("fields", {}).get("filename")
+        ))
         
-        if documents:
-            doc_list = list(documents)
+        if doc_list:
             if len(doc_list) == 1:
                 answer = f"📄 **Answer:** The document **{doc_list[0]}** discusses '{search_terms}'"
             else:
@@ -365,13 +867,14 @@ If no results are relevant, return "none"
         else:
             return search_result
     
-    def _format_search_results(self, hits: List[Dict], query: str) -> str:
+    def _format_search_results(self, hits: List[Dict], query: str, filtered_hits: List[Dict] = None) -> str:
         """Format search results with intelligent filtering"""
         if not hits:
             return f"🔍 No results for: '{query}'"
         
-        # Filter results using LLM
-        filtered_hits = self._filter_search_results(hits, query)
+        # Filter results using LLM, unless the caller already did
+        if filtered_hits is None:
+            filtered_hits = self._filter_search_results(hits, query)
         
         if not filtered_hits:
             return f"🔍 No relevant results found for: '{query}'\n\n💡 The search found some results, but they weren't directly related to your query. Try different keywords or be more specific."
@@ -431,28 +934,17 @@ If no results are relevant, return "none"
         query = state["query"]
         context_file = state.get("context_file")
         
-        # Create intelligent analysis prompt for LLM
-        analysis_prompt = f"""
-Analyze this user query and determine their intent:
-
-USER QUERY: "{query}"
-CONTEXT FILE: {context_file if context_file else "None"}
-
-Guidelines:
-- EDIT: User wants to modify, change, update, add to, or alter content
-- SEARCH: User wants to find or look for information across multiple documents OR when no context file is provided
-- VIEW: User wants to see raw file content or display specific sections
-- ANALYZE: User asks questions about document content, wants explanations, summaries, or specific information from the document (like "what is the timeline", "tell me about", "explain", etc.)
-- CHAT: General conversation or unclear intent
-
-Important: If there's a context file and the user is asking a question about the document content (like "what is...", "tell me about...", "explain..."), choose ANALYZE, not SEARCH or VIEW.
-
-Respond with ONLY ONE WORD: EDIT, SEARCH, VIEW, ANALYZE, or CHAT
-"""
-        
         try:
-            response = self.llm.invoke([SystemMessage(content=analysis_prompt)])
-            intent = response.content.strip().upper()
+            local_intent = _classify_intent_locally(query, bool(context_file))
+            cache_key = (hashlib.sha256(query.encode()).hexdigest(), bool(context_file))
+            with _llm_cache_lock:
+                intent = local_intent or _intent_cache.get(cache_key)
+            if intent is None:
+                analysis_prompt = _INTENT_PROMPT.format(query=query, context_file=context_file or "None")
+                response = self.llm_small.invoke([SystemMessage(content=analysis_prompt)])
+                intent = response.content.strip().upper()
+                with _llm_cache_lock:
+                    _intent_cache[cache_key] = intent
             
             # Map LLM response to our state
             intent_map = {
@@ -464,7 +956,10 @@ Respond with ONLY ONE WORD: EDIT, SEARCH, VIEW, ANALYZE, or CHAT
             }
             
             state["query_type"] = intent_map.get(intent, QueryType.CHAT)
-            state["confidence"] = 0.9 if intent in intent_map else 0.5
+            if local_intent:
+                state["confidence"] = 0.85
+            else:
+                state["confidence"] = 0.9 if intent in intent_map else 0.5
             
             # Set entities based on intent and context
             entities = {}
@@ -521,7 +1016,7 @@ Respond with ONLY ONE WORD: EDIT, SEARCH, VIEW, ANALYZE, or CHAT
             query = state["query"]
             
             # Check if this is a "which document" question
-            if any(phrase in query.lower() for phrase in ["which document", "what document", "which file", "what file"]):
+            if _DOCUMENT_QUESTION_RE.search(query):
                 result = self._answer_document_question(search_terms, query)
             else:
                 result = self._search_tool(search_terms)
@@ -580,78 +1075,30 @@ Respond with ONLY ONE WORD: EDIT, SEARCH, VIEW, ANALYZE, or CHAT
         """Let LLM handle the entire edit process intelligently"""
         try:
             # Read the full file content
-            resolved_path = self._resolve_filepath(filename)
-            if not os.path.exists(resolved_path):
+            resolved_path, exists = self._resolve_filepath(filename)
+            if not exists:
                 return f"❌ File not found: {filename}"
             
-            with open(resolved_path, 'r', encoding='utf-8') as f:
+            with open(resolved_path, 'r', encoding='utf-8', buffering=FILE_BUFFER_SIZE) as f:
                 full_content = f.read()
             
-            # Let LLM analyze the edit request and perform the edit
-            edit_prompt = f"""
-You are a smart document editor. The user wants to edit this document.
-
-DOCUMENT: {filename}
-CURRENT CONTENT:
-{full_content}
-
-USER REQUEST: "{edit_request}"
-
-Your task:
-1. Understand what the user wants to edit/add/modify
-2. Find the relevant section in the document
-3. Make the requested changes while preserving the document structure
-4. Return ONLY the complete updated document content
-
-Important:
-- Preserve all existing content except what needs to be changed
-- Maintain the same formatting and structure
-- If adding content, add it in the appropriate location
-- Do not add explanations, just return the updated document
-"""
+            # Let LLM analyze the edit request; it answers with line edits, not the whole document
+            lines = full_content.splitlines(keepends=True)
+            numbered_content = ''.join(f"{number}: {line}" for number, line in enumerate(lines, 1))
+            edit_prompt = _EDIT_PROMPT.format(filename=filename, numbered_content=numbered_content, edit_request=edit_request)
             
-            response = self.llm.invoke([SystemMessage(content=edit_prompt)])
-            new_content = response.content.strip()
+            response = self._edit_llm.invoke([SystemMessage(content=edit_prompt)])
+            try:
+                edits = json.loads(response.content)["edits"]
+                new_content = ''.join(_apply_line_edits(lines, edits))
+            except (ValueError, TypeError, KeyError) as e:
+                return f"❌ Edit error: could not apply the suggested changes ({str(e)})"
             
             # Create backup
-            backup_path = f"{resolved_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            with open(backup_path, 'w', encoding='utf-8') as f:
-                f.write(full_content)
+            backup_path = self._backup(resolved_path, full_content)
             
             # Write the new content
-            with open(resolved_path, 'w', encoding='utf-8') as f:
-                f.write(new_content)
-            
-            # Notify clients about file change via WebSocket
-            try:
-                filename_only = os.path.basename(resolved_path)
-                tracker = get_content_tracker(os.path.dirname(resolved_path))
-                diff_result = tracker.get_diff(filename_only)
-                has_changes = diff_result.has_changes if diff_result else True
-                changes_count = diff_result.changes_count if diff_result else 1
-                
-                # Use asyncio to run the async broadcast
-                import asyncio
-                try:
-                    loop = asyncio.get_event_loop()
-                    loop.create_task(manager.broadcast({
-                        "type": "file_changed",
-                        "filename": filename_only,
-                        "has_changes": has_changes,
-                        "changes": changes_count,
-                        "timestamp": datetime.now().isoformat()
-                    }))
-                except RuntimeError:
-                    # If no event loop is running, create a new one
-                    asyncio.run(manager.broadcast({
-                        "type": "file_changed",
-                        "filename": filename_only,
-                        "has_changes": has_changes,
-                        "changes": changes_count,
-                        "timestamp": datetime.now().isoformat()
-                    }))
-            except Exception as ws_error:
-                print(f"⚠️ WebSocket notification failed: {ws_error}")
+            _write_atomic(resolved_path, new_content)
             
             return f"✅ **Edit completed successfully!**\n\n**File:** {resolved_path}\n**Backup:** {backup_path}\n\n**Changes made:** The document has been updated according to your request."
             
@@ -681,22 +1128,18 @@ Important:
                         break
         
         # Extract section to search for
-        if "core section" in query_lower:
-            analysis["search_terms"] = "core system"
-        elif "introduction" in query_lower:
-            analysis["search_terms"] = "introduction"
-        elif "experience" in query_lower:
-            analysis["search_terms"] = "experience"
-        else:
-            analysis["search_terms"] = "core"  # Default fallback
+        sections = {match.lower() for match in _SECTION_RE.findall(query_lower)}
+        analysis["search_terms"] = next(
+            (_SECTION_KEYWORDS[section] for section in _SECTION_PRIORITY if section in sections),
+            "core"  # Default fallback
+        )
         
         # Determine edit type
-        if any(word in query_lower for word in ["add", "adding", "insert"]):
-            analysis["edit_type"] = "add"
-        elif any(word in query_lower for word in ["replace", "change"]):
-            analysis["edit_type"] = "replace"
-        elif any(word in query_lower for word in ["update", "modify", "edit"]):
-            analysis["edit_type"] = "modify"
+        edit_types = {_EDIT_TYPE_KEYWORDS[word.lower()] for word in _EDIT_TYPE_RE.findall(query_lower)}
+        analysis["edit_type"] = next(
+            (edit_type for edit_type in _EDIT_TYPE_PRIORITY if edit_type in edit_types),
+            "modify"
+        )
         
         return analysis
     
@@ -710,22 +1153,9 @@ Important:
         else:
             section_content = current_section
         
-        rewrite_prompt = f"""
-Current section content:
-{section_content}
-
-Edit instruction: {edit_instruction}
-Edit type: {edit_type}
-
-Instructions:
-- If edit_type is "add": Add the new content to the existing content (usually at the end)
-- If edit_type is "replace": Replace specific parts while keeping the structure
-- If edit_type is "modify": Modify the content while preserving the overall structure
-- If edit_type is "insert": Insert new content at appropriate location
-
-Provide ONLY the new section content. Keep the same formatting style and structure.
-Do not include explanations or markdown code blocks.
-"""
+        rewrite_prompt = _REWRITE_PROMPT.format(
+            section_content=section_content, edit_instruction=edit_instruction, edit_type=edit_type
+        )
         
         try:
             response = self.llm.invoke([SystemMessage(content=rewrite_prompt)])
@@ -753,15 +1183,21 @@ Do not include explanations or markdown code blocks.
                 result = "❌ No document specified for analysis"
             else:
                 # Read the full document content directly
-                resolved_path = self._resolve_filepath(filename)
-                if not os.path.exists(resolved_path):
+                resolved_path, exists = self._resolve_filepath(filename)
+                if not exists:
                     result = f"❌ Document not found: {filename}"
                 else:
-                    with open(resolved_path, 'r', encoding='utf-8') as f:
-                        full_content = f.read()
+                    try:
+                        full_content = _read_document(resolved_path)
+                    except FileNotFoundError:
+                        # Removed since the file index was built
+                        full_content = None
                     
-                    # Analyze based on the specific query
-                    result = self._analyze_document_content(full_content, query, filename, analysis_type)
+                    if full_content is None:
+                        result = f"❌ Document not found: {filename}"
+                    else:
+                        # Analyze based on the specific query
+                        result = self._analyze_document_content(full_content, query, filename, analysis_type)
             
             state["next_action"] = "analysis_completed"
             state["messages"].append(AIMessage(content=result))
@@ -772,66 +1208,130 @@ Do not include explanations or markdown code blocks.
         return state
     
     def _analyze_document_content(self, content: str, query: str, filename: str, analysis_type: str) -> str:
-        """Analyze document content directly using LLM"""
-        
-        query_lower = query.lower()
+        """Analyze document content directly using LLM, streaming the answer to graph.stream() callers"""
+        writer = get_stream_writer()
+        parts = []
+        for chunk in self.analyze_stream(content, filename, query, analysis_type):
+            writer(chunk)
+            parts.append(chunk)
+        return "".join(parts)
+    
+    def _condense_document(self, content: str) -> str:
+        """Return content as is, or for long documents a digest of section summaries that fits the prompt.
+        Summaries are cached per section, so only edited sections are summarized again."""
+        if len(content) <= ANALYSIS_MAX_CHARS:
+            return content
         
-        if any(phrase in query_lower for phrase in ["tell me about this", "about this document", "this document"]):
-            analysis_prompt = f"""
-Analyze this document and provide a comprehensive overview:
-
-DOCUMENT: {filename}
-CONTENT:
-{content}
-
-Provide a clear, structured analysis including:
-1. **Document Purpose**: What is this document about?
-2. **Key Sections**: What are the main sections/topics covered?
-3. **Important Details**: Key information, requirements, or proposals
-4. **Summary**: Brief overview of the main points
-
-Be concise but informative.
-"""
+        sections = _split_sections(content, SUMMARY_SECTION_CHARS)
+        keys = [hashlib.blake2b(section.encode('utf-8'), digest_size=16).hexdigest() for section in sections]
+        with _llm_cache_lock:
+            summaries = [_summary_cache.get(key) for key in keys]
         
-        elif "core system" in query_lower:
-            analysis_prompt = f"""
-Analyze this document and focus specifically on the core system information:
-
-DOCUMENT: {filename}
-CONTENT:
-{content}
-
-Focus on:
-1. **Core System Components**: What are the main technical components?
-2. **Architecture**: How is the system structured?
-3. **Key Features**: What are the primary capabilities?
-4. **Technical Details**: Important technical specifications
-
-Provide a focused answer about the core system.
-"""
+        missing = [i for i, summary in enumerate(summaries) if summary is None]
+        if missing:
+            print(f"📚 Summarizing {len(missing)} of {len(sections)} sections of a {len(content)}-character document")
+            responses = self.llm_small.batch(
+                [_SUMMARY_PROMPT.format(index=i + 1, total=len(sections), section=sections[i]) for i in missing],
+                config={"max_concurrency": SEARCH_CONCURRENCY},
+                return_exceptions=True
+            )
+            for i, response in zip(missing, responses):
+                if isinstance(response, Exception):
+                    # Keep the start of the section rather than dropping it
+                    summaries[i] = sections[i][:SUMMARY_SECTION_CHARS // 5]
+                    continue
+                summaries[i] = response.content
+                with _llm_cache_lock:
+                    _summary_cache[keys[i]] = response.content
         
-        else:
-            # General analysis
-            analysis_prompt = f"""
-Analyze this document to answer the user's question: "{query}"
-
-DOCUMENT: {filename}
-CONTENT:
-{content}
-
-Provide a direct, helpful answer to their specific question based on the document content.
-If the question can't be answered from the document, say so clearly.
-"""
+        # Very long documents give more summaries than fit; each then keeps an equal share
+        share = ANALYSIS_MAX_CHARS // len(sections) - 64
+        if sum(len(summary) for summary in summaries) > ANALYSIS_MAX_CHARS - 64 * len(sections):
+            summaries = [summary[:share] for summary in summaries]
+        digest = "\n\n".join(f"[Section {i + 1} of {len(sections)}]\n{summary}" for i, summary in enumerate(summaries))
+        return f"(Long document: condensed into section summaries)\n\n{digest}"
+    
+    def analyze_stream(self, content: str, filename: str, query: str, analysis_type: str = "summary") -> Iterator[str]:
+        """Answer a question about one document, yielding the answer as the LLM writes it"""
+        header = f"📄 **Analysis of {os.path.basename(filename)}**\n\n"
+        prefix, content_hash = _analysis_prefix(self._condense_document(content), filename)
+        cache_key = _analysis_cache_key(query, analysis_type, filename, content_hash)
+        if cache_key is not None:
+            with _llm_cache_lock:
+                answer = _analysis_cache.get(cache_key)
+            if answer is not None:
+                yield header + answer
+                return
         
+        parts = []
+        response = None
         try:
-            response = self.llm.invoke([SystemMessage(content=analysis_prompt)])
-            
-            # Format the response nicely
-            doc_name = os.path.basename(filename)
-            return f"📄 **Analysis of {doc_name}**\n\n{response.content}"
-            
+            for chunk in self.llm.stream(prefix + [HumanMessage(content=_analysis_task(query))]):
+                response = chunk if response is None else response + chunk
+                if chunk.content:
+                    if not parts:
+                        yield header
+                    parts.append(chunk.content)
+                    yield chunk.content
         except Exception as e:
-            return f"❌ Error analyzing document: {str(e)}"
+            # Mid-answer failures keep what was already sent and append the error
+            separator = "\n\n" if parts else ""
+            yield f"{separator}❌ Error analyzing document: {str(e)}"
+            return
+        if not parts:
+            yield header
+        
+        cached_tokens, input_tokens = _prompt_cache_usage(response)
+        if cached_tokens and input_tokens:
+            print(f"🧠 Prompt cache: {cached_tokens} of {input_tokens} input tokens ({cached_tokens / input_tokens:.0%})")
+        
+        # An empty answer is not worth repeating for the rest of the TTL
+        if cache_key is not None and parts:
+            with _llm_cache_lock:
+                _analysis_cache[cache_key] = "".join(parts)
+    
+    def analyze_batch(self, content: str, filename: str, queries: List[str], analysis_type: str = "summary") -> List[str]:
+        """Answer several questions about one document. Uncached questions go out as one concurrent
+        batch sharing the document prefix, so the provider's prompt cache can serve it after the first"""
+        doc_name = os.path.basename(filename)
+        prefix, content_hash = _analysis_prefix(self._condense_document(content), filename)
+        
+        answers: List[Optional[str]] = [None] * len(queries)
+        pending: Dict[int, Any] = {}
+        errors: Dict[int, str] = {}
+        for i, query in enumerate(queries):
+            cache_key = _analysis_cache_key(query, analysis_type, filename, content_hash)
+            if cache_key is not None:
+                with _llm_cache_lock:
+                    answers[i] = _analysis_cache.get(cache_key)
+            if answers[i] is None:
+                pending[i] = (prefix + [HumanMessage(content=_analysis_task(query))], cache_key)
+        
+        if pending:
+            responses = self.llm.batch(
+                [messages for messages, _ in pending.values()],
+                config={"max_concurrency": SEARCH_CONCURRENCY},
+                return_exceptions=True
+            )
+            for (i, (_, cache_key)), response in zip(pending.items(), responses):
+                if isinstance(response, Exception):
+                    errors[i] = f"❌ Error analyzing document: {str(response)}"
+                    continue
+                
+                cached_tokens, input_tokens = _prompt_cache_usage(response)
+                if cached_tokens and input_tokens:
+                    print(f"🧠 Prompt cache: {cached_tokens} of {input_tokens} input tokens ({cached_tokens / input_tokens:.0%})")
+                
+                if cache_key is not None and response.content:
+                    with _llm_cache_lock:
+                        _analysis_cache[cache_key] = response.content
+                answers[i] = response.content
+        
+        # Format the responses nicely
+        return [
+            errors[i] if i in errors else f"📄 **Analysis of {doc_name}**\n\n{answer}"
+            for i, answer in enumerate(answers)
+        ]
     
     def _respond_node(self, state: AgentState) -> AgentState:
         """Generate final response"""
@@ -853,36 +1353,59 @@ If the question can't be answered from the document, say so clearly.
         state["messages"].append(AIMessage(content=response))
         return state
     
+    def _initial_state(self, user_input: str, context_file: str = None) -> AgentState:
+        return AgentState(
+            messages=[HumanMessage(content=user_input)],
+            query=user_input,
+            query_type=QueryType.CHAT,
+            confidence=0.0,
+            entities={},
+            search_results=[],
+            file_content=None,
+            file_path=None,
+            section_start=None,
+            section_end=None,
+            edit_content=None,
+            next_action="",
+            error=None,
+            context_file=context_file
+        )
+    
+    @staticmethod
+    def _final_reply(final_state: AgentState) -> str:
+        # Return the last AI message; it is the one the final node just appended
+        return next(
+            (msg.content for msg in reversed(final_state["messages"]) if isinstance(msg, AIMessage)),
+            "❌ No response generated"
+        )
+    
     def chat(self, user_input: str, context_file: str = None) -> str:
         """Main chat interface with file context support"""
         try:
-            # Initialize state
-            initial_state = AgentState(
-                messages=[HumanMessage(content=user_input)],
-                query=user_input,
-                query_type=QueryType.CHAT,
-                confidence=0.0,
-                entities={},
-                search_results=[],
-                file_content=None,
-                file_path=None,
-                section_start=None,
-                section_end=None,
-                edit_content=None,
-                next_action="",
-                error=None,
-                context_file=context_file
-            )
-            
-            # Run the graph
-            final_state = self.graph.invoke(initial_state)
-            
-            # Return the last AI message
-            ai_messages = [msg for msg in final_state["messages"] if isinstance(msg, AIMessage)]
-            return ai_messages[-1].content if ai_messages else "❌ No response generated"
+            final_state = self.graph.invoke(self._initial_state(user_input, context_file))
+            return self._final_reply(final_state)
             
         except Exception as e:
             return f"❌ Error processing query: {str(e)}"
+    
+    def chat_stream(self, user_input: str, context_file: str = None) -> Iterator[str]:
+        """Like chat, but yields the reply in pieces: document analysis arrives as the LLM writes it,
+        other replies in one piece"""
+        streamed = False
+        final_state = None
+        try:
+            for mode, payload in self.graph.stream(self._initial_state(user_input, context_file), stream_mode=["custom", "values"]):
+                if mode == "custom":
+                    streamed = True
+                    yield payload
+                else:
+                    final_state = payload
+        except Exception as e:
+            yield f"❌ Error processing query: {str(e)}"
+            return
+        
+        if not streamed:
+            yield self._final_reply(final_state)
 
 def create_graph_agent() -> SmartGraphAgent:
     """Factory function to create the graph agent"""
@@ -14,12 +14,12 @@ from datetime import datetime
 from langgraph.graph import StateGraph, END
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
 from langchain_groq import ChatGroq
-from langchain.tools import StructuredTool
+from langchain_core.tools import StructuredTool
 from pydantic import BaseModel, Field
 from pinecone import Pinecone
 from dotenv import load_dotenv
 
-from app.services.database_service import DatabaseService
+from app.services.database_service import DatabaseService, invalidate_file
 from app.utils.exceptions import AppException
 
 load_dotenv()
@@ -236,6 +236,7 @@ class SupabaseGraphAgent:
             }
             
             result = self.db_service.supabase.table("files").update(update_data).eq("id", file_id).execute()
+            invalidate_file(file_id)
             
             if result.data:
                 print(f"✅ File updated successfully: {filename}")
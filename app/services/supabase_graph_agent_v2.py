@@ -9,6 +9,7 @@ import random
 from typing import Dict, List, Any, Optional, TypedDict, Annotated
 from enum import Enum
 from datetime import datetime
+from functools import lru_cache
 
 from langgraph.graph import StateGraph, END
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
@@ -16,11 +17,20 @@ from langchain_groq import ChatGroq
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from app.services.database_service import DatabaseService
+from app.services.database_service import DatabaseService, invalidate_file
 from app.utils.exceptions import AppException
 
 load_dotenv()
 
+@lru_cache(maxsize=8)
+def _chat_model(model: str) -> ChatGroq:
+    """One Groq client per model, shared by all workspace agents"""
+    return ChatGroq(
+        groq_api_key=os.getenv("GROQ_API_KEY"),
+        model=model,
+        temperature=0.3
+    )
+
 class QueryType(Enum):
     SEARCH = "search"
     EDIT = "edit" 
@@ -40,18 +50,14 @@ class AgentState(TypedDict):
     error: Optional[str]
 
 class SmartSupabaseAgent:
-    def __init__(self, workspace_id: str, user_id: str, model: str = None):
-        # Core setup
+    def __init__(self, workspace_id: str, user_id: str, model: str = None, db_service: DatabaseService = None):
+        # Core setup; pass the shared DatabaseService in to reuse its Supabase client
         self.workspace_id = workspace_id
         self.user_id = user_id
-        self.db_service = DatabaseService()
+        self.db_service = db_service or DatabaseService()
         
         # LLM with higher temperature for natural responses
-        self.llm = ChatGroq(
-            groq_api_key=os.getenv("GROQ_API_KEY"),
-            model=model or "llama3-70b-8192",
-            temperature=0.3
-        )
+        self.llm = _chat_model(model or "llama3-70b-8192")
         
         # Conversation memory for this session
         self.conversation_history = []
@@ -484,6 +490,7 @@ Return ONLY the updated document content - no explanations or prefixes.
             }
             
             result = self.db_service.supabase.table("files").update(update_data).eq("id", file_id).execute()
+            invalidate_file(file_id)
             
             if result.data:
                 print(f"✅ File updated successfully")
@@ -541,6 +548,6 @@ Return ONLY the updated document content - no explanations or prefixes.
             print(f"❌ Chat error: {e}")
             return f"I encountered an error: {str(e)}"
 
-def create_supabase_agent(workspace_id: str, user_id: str, model: str = None) -> SmartSupabaseAgent:
+def create_supabase_agent(workspace_id: str, user_id: str, model: str = None, db_service: DatabaseService = None) -> SmartSupabaseAgent:
     """Factory function to create agent"""
-    return SmartSupabaseAgent(workspace_id, user_id, model)
\ No newline at end of file
+    return SmartSupabaseAgent(workspace_id, user_id, model, db_service)
\ No newline at end of file
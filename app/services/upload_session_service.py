@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import re
+import secrets
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+import orjson
+from fastapi import UploadFile
+
+from app.config import settings
+from app.services.file_service import FileService
+from app.utils.exceptions import AppException
+from app.utils.upload_dir import get_upload_dir
+
+logger = logging.getLogger(__name__)
+
+# Unfinished sessions older than this are deleted
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+_UPLOAD_ID_RE = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+_CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+def _write_at(path: Path, offset: int, data: bytes):
+    """Write data into an existing file at offset (blocking)"""
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+class UploadSessionService:
+    """Resumable uploads: the client sends a file as byte ranges, then asks for it to be converted.
+    Partial files live in UPLOAD_DIR (or the process temp dir), so a session is only visible to the
+    instance that created it."""
+
+    def __init__(self, file_service: FileService):
+        self.file_service = file_service
+        self.session_dir = Path(get_upload_dir()) / "upload-sessions"
+        self.session_dir.mkdir(parents=True, exist_ok=True)
+
+    async def create_session(self, filename: str, size: int, user_id: str, workspace_id: str = None) -> Dict[str, Any]:
+        """Start a resumable upload; rejects unsupported or oversized files before any bytes are sent"""
+        if size <= 0:
+            raise AppException("File is empty", 400)
+        if size > settings.MAX_FILE_SIZE:
+            raise AppException("File too large", 413)
+        if Path(filename).suffix.lower() not in settings.ALLOWED_FILE_TYPES_SET:
+            raise AppException("File type not supported", 400)
+
+        await asyncio.to_thread(self._purge_expired)
+
+        upload_id = secrets.token_urlsafe(16)
+        meta = {
+            "filename": filename,
+            "size": size,
+            "user_id": user_id,
+            "workspace_id": workspace_id
+        }
+
+        def _create():
+            self._part_path(upload_id).touch()
+            self._meta_path(upload_id).write_bytes(orjson.dumps(meta))
+
+        await asyncio.to_thread(_create)
+        logger.info(f"Started upload session {upload_id} for {filename} ({size} bytes)")
+        return {"upload_id": upload_id, "filename": filename, "offset": 0, "size": size}
+
+    async def get_status(self, upload_id: str, user_id: str) -> Dict[str, Any]:
+        """Current offset of an upload, so an interrupted client knows where to resume"""
+        meta = await self._load_session(upload_id, user_id)
+        return self._status(upload_id, meta, self._part_path(upload_id).stat().st_size)
+
+    async def append_chunk(self, upload_id: str, user_id: str, content_range: str, data: bytes) -> Dict[str, Any]:
+        """Write a `bytes start-end/total` range. Ranges may overlap what was already received
+        (a resent chunk) but must not leave a gap."""
+        meta = await self._load_session(upload_id, user_id)
+
+        match = _CONTENT_RANGE_RE.match(content_range or "")
+        if not match:
+            raise AppException("Missing or invalid Content-Range header", 400)
+        start, end, total = (int(group) for group in match.groups())
+
+        if total != meta["size"] or end < start or end >= total or end - start + 1 != len(data):
+            raise AppException("Content-Range does not match the upload or the request body", 416)
+
+        part_path = self._part_path(upload_id)
+        offset = part_path.stat().st_size
+        if start > offset:
+            raise AppException(f"Chunk starts past the received offset {offset}", 416)
+
+        await asyncio.to_thread(_write_at, part_path, start, data)
+        return self._status(upload_id, meta, max(offset, end + 1))
+
+    async def complete(self, upload_id: str, user_id: str) -> Dict[str, Any]:
+        """Convert and save a fully received upload, then discard the session"""
+        meta = await self._load_session(upload_id, user_id)
+        part_path = self._part_path(upload_id)
+
+        received = part_path.stat().st_size
+        if received != meta["size"]:
+            raise AppException(f"Upload incomplete: {received} of {meta['size']} bytes received", 409)
+
+        upload = UploadFile(file=open(part_path, "rb"), filename=meta["filename"], size=received)
+        try:
+            result = await self.file_service.process_upload(
+                file=upload,
+                user_id=user_id,
+                workspace_id=meta["workspace_id"]
+            )
+        finally:
+            await upload.close()
+
+        # Keep failed sessions so the client can retry completion; they expire with the TTL
+        await asyncio.to_thread(self._remove, upload_id)
+        return result
+
+    async def _load_session(self, upload_id: str, user_id: str) -> Dict[str, Any]:
+        """Load session metadata, hiding other users' sessions behind a 404"""
+        if not _UPLOAD_ID_RE.match(upload_id):
+            raise AppException("Upload session not found", 404)
+
+        try:
+            meta = orjson.loads(await asyncio.to_thread(self._meta_path(upload_id).read_bytes))
+        except FileNotFoundError:
+            raise AppException("Upload session not found", 404)
+
+        if meta["user_id"] != user_id:
+            raise AppException("Upload session not found", 404)
+        return meta
+
+    def _status(self, upload_id: str, meta: Dict[str, Any], offset: int) -> Dict[str, Any]:
+        return {"upload_id": upload_id, "filename": meta["filename"], "offset": offset, "size": meta["size"]}
+
+    def _part_path(self, upload_id: str) -> Path:
+        return self.session_dir / f"{upload_id}.part"
+
+    def _meta_path(self, upload_id: str) -> Path:
+        return self.session_dir / f"{upload_id}.json"
+
+    def _remove(self, upload_id: str):
+        for path in (self._part_path(upload_id), self._meta_path(upload_id)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _purge_expired(self):
+        """Delete files of sessions that were abandoned (blocking)"""
+        cutoff = time.time() - UPLOAD_SESSION_TTL
+        for entry in os.scandir(self.session_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
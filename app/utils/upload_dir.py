@@ -0,0 +1,47 @@
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from starlette import formparsers
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# UPLOAD_DIR once setup_upload_dir() has found it usable
+_upload_dir: Optional[str] = None
+
+class _UploadSpool(tempfile.SpooledTemporaryFile):
+    """Starlette's upload buffer, spilling to UPLOAD_DIR instead of the process temp dir"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("dir", _upload_dir)
+        super().__init__(*args, **kwargs)
+
+def setup_upload_dir():
+    """Make Starlette spill large uploads to UPLOAD_DIR. Only upload buffers go there:
+    the process temp dir, used by conversion libraries and workers, is left alone."""
+    global _upload_dir
+
+    # Uploads are transient buffers, so on tmpfs (the /dev/shm default) a spill is a
+    # memcpy rather than a disk write that is deleted moments later. The trade-off is
+    # that spilled uploads count against RAM: size /dev/shm for MAX_FILE_SIZE times the
+    # expected concurrent uploads (Docker defaults it to 64MB; see --shm-size).
+    upload_dir = Path(settings.UPLOAD_DIR)
+    try:
+        upload_dir.mkdir(parents=True, exist_ok=True)
+        if not os.access(upload_dir, os.W_OK):
+            raise PermissionError(f"{upload_dir} is not writable")
+    except OSError as e:
+        logger.warning(f"Upload dir unavailable, using {tempfile.gettempdir()}: {str(e)}")
+        return
+
+    _upload_dir = str(upload_dir)
+    # MultiPartParser creates its spool files through this module attribute
+    formparsers.SpooledTemporaryFile = _UploadSpool
+
+def get_upload_dir() -> str:
+    """Directory for upload data: UPLOAD_DIR when usable, otherwise the process temp dir"""
+    return _upload_dir or tempfile.gettempdir()
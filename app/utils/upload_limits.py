@@ -0,0 +1,61 @@
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+
+# Allowance for multipart boundaries, part headers and the other form fields
+MULTIPART_OVERHEAD = 64 * 1024
+
+class UploadLimitMiddleware:
+    """Reject oversized uploads from their Content-Length header, before any body bytes are read.
+    Route dependencies run only after FastAPI has parsed the multipart form, too late to save the transfer.
+    Bodies without a Content-Length (chunked transfer) are counted as they arrive and cut off at the limit.
+    `paths` maps each guarded path to the number of files its form may carry."""
+    
+    def __init__(self, app: ASGIApp, paths: dict = None):
+        self.app = app
+        self.paths = paths or {"/upload": 1}
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        max_files = self.paths.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if not max_files:
+            await self.app(scope, receive, send)
+            return
+        
+        limit = max_files * settings.MAX_FILE_SIZE + MULTIPART_OVERHEAD
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if value.isdigit() and int(value) > limit:
+                    await self._reject(scope, receive, send)
+                    return
+                break
+        
+        received = 0
+        rejected = False
+        
+        async def limited_receive() -> Message:
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Answer now; the app sees a disconnect and its own response is dropped
+                    rejected = True
+                    await self._reject(scope, receive, send)
+                    return {"type": "http.disconnect"}
+            return message
+        
+        async def guarded_send(message: Message):
+            if not rejected:
+                await send(message)
+        
+        await self.app(scope, limited_receive, guarded_send)
+    
+    async def _reject(self, scope: Scope, receive: Receive, send: Send):
+        response = JSONResponse(
+            status_code=413,
+            content={"error": "File too large", "detail": None}
+        )
+        await response(scope, receive, send)
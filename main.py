@@ -1,23 +1,40 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import logging
 
 from app.config import settings
-from app.routes import upload, health, embedding, workspace_agent
+from app.dependencies import get_file_service
+from app.routes import agent, upload, health, embedding, workspace_agent
 from app.utils.exceptions import AppException
 from app.utils.logger import setup_logging
+from app.utils.upload_dir import setup_upload_dir
+from app.utils.upload_limits import UploadLimitMiddleware
 
 # Setup logging
 setup_logging()
+setup_upload_dir()
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Only shut down services that were actually created
+    if get_file_service.cache_info().currsize:
+        await get_file_service().close()
+
 app = FastAPI(
     title="Document Processing API",
     description="API for uploading and processing documents with PyMuPDF and python-docx",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Reject oversized uploads before reading their body (added first so CORS still wraps the 413)
+app.add_middleware(UploadLimitMiddleware, paths={"/upload": 1, "/upload/batch": settings.MAX_BATCH_FILES})
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -40,6 +57,7 @@ app.include_router(health.router, prefix="/health", tags=["health"])
 app.include_router(upload.router, prefix="", tags=["upload"])
 app.include_router(embedding.router, prefix="", tags=["embedding"])
 app.include_router(workspace_agent.router, prefix="/api", tags=["workspace-agent"])
+app.include_router(agent.router)  # routes under /agent
 
 
 
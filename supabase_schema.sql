@@ -29,6 +29,8 @@ CREATE TABLE public.files (
   filename text NOT NULL,
   file_type text DEFAULT 'markdown'::text,
   content text DEFAULT ''::text,
+  content_length integer GENERATED ALWAYS AS (length(content)) STORED,
+  source_hash text,  -- SHA-256 of the uploaded document `content` was converted from; cleared on edit
   created_by uuid NOT NULL,
   created_at timestamp with time zone DEFAULT now(),
   updated_at timestamp with time zone DEFAULT now(),
@@ -36,6 +38,7 @@ CREATE TABLE public.files (
   CONSTRAINT files_workspace_id_fkey FOREIGN KEY (workspace_id) REFERENCES public.workspaces(id),
   CONSTRAINT files_created_by_fkey FOREIGN KEY (created_by) REFERENCES public.users(id)
 );
+CREATE INDEX files_source_hash_idx ON public.files (source_hash, filename, created_by) WHERE source_hash IS NOT NULL;
 
 -- 4. Create remaining tables (all depend on users and/or workspaces and/or files)
 CREATE TABLE public.chat_messages (
@@ -119,4 +122,63 @@ CREATE TABLE public.workspace_requests (
   CONSTRAINT workspace_requests_requester_id_fkey FOREIGN KEY (requester_id) REFERENCES public.users(id),
   CONSTRAINT workspace_requests_reviewed_by_fkey FOREIGN KEY (reviewed_by) REFERENCES public.users(id),
   CONSTRAINT workspace_requests_workspace_id_fkey FOREIGN KEY (workspace_id) REFERENCES public.workspaces(id)
-);
\ No newline at end of file
+);
+
+-- 5. Helper functions
+-- Effective role of a user in a workspace: 'owner' for the workspace owner,
+-- otherwise the collaborator role, otherwise NULL. Lets the API authorize
+-- workspace requests with a single round trip.
+CREATE OR REPLACE FUNCTION public.workspace_effective_role(p_workspace_id uuid, p_user_id uuid)
+RETURNS text
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT CASE
+    WHEN EXISTS (
+      SELECT 1 FROM public.workspaces w
+      WHERE w.id = p_workspace_id AND w.owner_id = p_user_id
+    ) THEN 'owner'
+    ELSE (
+      SELECT c.role FROM public.collaborators c
+      WHERE c.workspace_id = p_workspace_id AND c.user_id = p_user_id
+      LIMIT 1
+    )
+  END;
+$$;
+
+-- Files of a workspace, returned only if the user owns it or collaborates on it.
+-- Combines the access check and the file fetch into a single round trip; an
+-- empty result means either no access or no files.
+CREATE OR REPLACE FUNCTION public.get_workspace_files_for_user(p_workspace_id uuid, p_user_id uuid)
+RETURNS SETOF public.files
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT f.* FROM public.files f
+  WHERE f.workspace_id = p_workspace_id
+    AND EXISTS (
+      SELECT 1 FROM public.collaborators c
+      WHERE c.workspace_id = p_workspace_id AND c.user_id = p_user_id
+      UNION ALL
+      SELECT 1 FROM public.workspaces w
+      WHERE w.id = p_workspace_id AND w.owner_id = p_user_id
+    );
+$$;
+
+-- Once a file's content is edited it no longer matches the uploaded document,
+-- so it must not be reused for later uploads of that document.
+CREATE OR REPLACE FUNCTION public.files_clear_source_hash()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF NEW.content IS DISTINCT FROM OLD.content THEN
+    NEW.source_hash := NULL;
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER files_clear_source_hash
+BEFORE UPDATE OF content ON public.files
+FOR EACH ROW EXECUTE FUNCTION public.files_clear_source_hash();